@@ -1,52 +1,64 @@
+import os
+import sys
+from pathlib import Path
 import pandas as pd
-import geopandas as gpd
+
+# area_assign.py lives in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from area_assign import PolygonIndex, WARD_COLUMNS, LONDON_BBOX
 
 # Paths
 ward_shp   = r"C:\Coding\CBL-London-Crime-\London-wards-2018-ESRI\London_Ward.shp"
+# A cleaned CSV, or the yearly partition directory written by stream_clean.py
 crime_csv  = r"C:\Users\borka\Downloads\all_burglaries_london_cleaned.csv"
 output_csv = r"C:\Users\borka\Downloads\London_burglaries_with_wards_correct.csv"
+# Optional: also attach the containing LSOA (LSOA21CD) from this shapefile
+lsoa_shp   = None
+
+CHUNK_SIZE = 500_000   # crimes assigned per chunk
+
+
+def read_crimes(path):
+    """Chunks of a single CSV, or of every partition file in a directory"""
+    files = sorted(Path(path).glob("*.csv")) if os.path.isdir(path) else [path]
+    for file in files:
+        yield from pd.read_csv(file, chunksize=CHUNK_SIZE)
+
+
+def main():
+    # Prepared polygon indexes (built once, then loaded from data/spatial_index)
+    wards = PolygonIndex(ward_shp)
+    lsoas = PolygonIndex(lsoa_shp, columns=['LSOA21CD'], bbox=LONDON_BBOX) if lsoa_shp else None
+
+    total = 0
+    for i, chunk in enumerate(read_crimes(crime_csv)):
+        # Attach ward attributes of the polygon each crime lies within,
+        # renaming shapefile fields to the target codes:
+        #   NAME       → WD24NM (ward name)
+        #   GSS_CODE   → WD24CD (ward code)
+        #   DISTRICT   → LAD24NM (borough name)
+        gdf = wards.assign(chunk, rename=WARD_COLUMNS)
+        if lsoas is not None:
+            gdf = lsoas.assign(gdf)
+
+        # Derive Month from dt
+        gdf['Month'] = pd.to_datetime(gdf['dt']).dt.strftime('%Y-%m')
+
+        # Drop the original dt column
+        gdf = gdf.drop(columns=['dt'], errors='ignore')
+
+        # Reorder so Month is second
+        cols = list(gdf.columns)
+        cols.remove('Month')
+        cols = [cols[0], 'Month'] + cols[1:]
+
+        # Append to CSV
+        gdf[cols].to_csv(output_csv, index=False, mode='w' if i == 0 else 'a', header=(i == 0))
+        total += len(gdf)
+        print(f"[{i + 1}] Assigned {total:,} crimes")
+
+    print(f"[DONE] Saved output to: {output_csv}")
 
 
-# Load shapefile (convert to WGS84) and crime CSV
-wards = gpd.read_file(ward_shp).to_crs("EPSG:4326")
-df    = pd.read_csv(crime_csv)
-
-# Turn crimes into a GeoDataFrame
-gdf_crimes = gpd.GeoDataFrame(
-    df,
-    geometry=gpd.points_from_xy(df.longitude, df.latitude),
-    crs="EPSG:4326"
-)
-
-# Spatial join: attach ward polygons’ attributes to each crime point
-gdf = gpd.sjoin(
-    gdf_crimes,
-    wards,
-    how="left",
-    predicate="within"
-)
-
-# Derive Month from dt
-gdf['Month'] = pd.to_datetime(gdf['dt']).dt.strftime('%Y-%m')
-
-# Drop the original dt and spatial/index columns
-gdf = gdf.drop(columns=['dt', 'geometry', 'index_right'], errors='ignore')
-
-# Rename shapefile fields to your target codes:
-#   NAME       → WD24NM (ward name)
-#   GSS_CODE   → WD24CD (ward code)
-#   DISTRICT   → LAD24NM (borough name)
-gdf.rename(columns={
-    'NAME':      'WD24NM',
-    'GSS_CODE':  'WD24CD',
-    'DISTRICT':  'LAD24NM'
-}, inplace=True)
-
-# Reorder so Month is second
-cols = list(gdf.columns)
-cols.remove('Month')
-cols = [cols[0], 'Month'] + cols[1:]
-
-# Save to CSV
-gdf[cols].to_csv(output_csv, index=False)
-print(f"[DONE] Saved output to: {output_csv}")
+if __name__ == '__main__':
+    main()
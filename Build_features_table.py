@@ -7,7 +7,9 @@ builds lagged & extra features, drops the first month (2010-12),
 normalizes inputs per-month (safely), computes a clean month feature,
 filters out any LSOAs that intersect the Greater London bounding box,
 adds features including rolling stats, changes, spatial context and
-ranks, then writes out a feature table for downstream GCN modeling.
+ranks, then writes out a feature table for downstream GCN modeling:
+one Parquet store (feature_store.py) with the raw features and their
+per-month z-scored `_z` versions.
 Imputes missing extras from previous month per LSOA, or 0 if none.
 Also saves ward code and ward name (WD24CD, WD24NM) as raw features.
 Derived metrics added:
@@ -15,356 +17,581 @@ Derived metrics added:
   - Month-over-month percent change
   - Year-over-year change
   - Ward-level average lagged by one month and deviation
+  - Neighbour mean / max / sum of the lag1, lag3 and 6-month rolling
+    columns over the LSOA contiguity graph (spatial_lag.py), as nbr_<stat>_<col>
+
+The panel is held as dense LSOA x month NumPy arrays (rows sorted by LSOA
+code, columns by month): lags are shifted slices, rolling windows are
+differences of cumulative sums and per-month statistics are column
+reductions, so no step needs a groupby, merge or sort. The long
+LSOA x month table is only assembled for the outputs.
+
+IMD, population and area come from the cached LSOA dimension table
+(lsoa_dimension.py), joined by LSOA id with one gather.
+
+Crime counts are built as a sparse CSR panel (count_panel.py) and only
+materialized densely for the months used. Every build saves that panel
+with the trailing state to outputs/feature_state (last carried-forward
+extras / population and last-crime month per LSOA). After a new month is ingested,
+    python Build_features_table.py --update YYYY-MM
+computes only that month's rows from the state and appends them to the
+feature store, instead of rebuilding the whole history.
 """
 
+import argparse
+import json
+import os
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
-import geopandas as gpd
-from shapely.geometry import box
+
+from area_codes import MISSING_ID, AreaCodeDictionary
+from count_panel import CountPanel
+from feature_store import FEATURE_STORE, write_features, write_zscore_stats
+from lsoa_dimension import IMD_COLUMNS, LsoaDimension
+from lsoa_graph import LsoaGraph
+from spatial_counts import density_columns
+from spatial_lag import STATS, SpatialLag
+
+INPUT_CSV = "London_burglaries_with_wards_correct_with_price.csv"
+SHP_PATH   = "LSOA_boundries/LSOA_2021_EW_BFE_V10.shp"
+N195_PATH = "N195.csv"
+POP_PATH = "Popdense.xlsx"
+KDE_PATH = "outputs/lsoa_kde_500m.csv"
+
+POPULATION_COLUMNS = ['Population', 'PopulationPerSqKm']
+
+# Columns whose neighbour mean / max / sum are added as nbr_<stat>_<col>
+SPATIAL_LAG_COLUMNS = ['crime_count_lag1', 'crime_count_lag3', 'roll_mean_6m', 'roll_std_6m']
+NBR_COLUMNS = [f'nbr_{stat}_{c}' for c in SPATIAL_LAG_COLUMNS for stat in STATS]
+
+# Trailing panel state saved by every build, read by --update
+FEATURE_STATE_DIR = Path("outputs/feature_state")
+COUNTS_FILE = "crime_counts.npz"
+
+
+def _lag(panel, k):
+    """Values k months earlier along the month axis, 0 before the first month"""
+    out = np.zeros(panel.shape, dtype=float)
+    out[:, k:] = panel[:, :-k]
+    return out
+
+
+def _ffill(panel):
+    """Forward-fill NaNs along the month axis"""
+    idx = np.where(np.isnan(panel), 0, np.arange(panel.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return panel[np.arange(panel.shape[0])[:, None], idx]
+
+
+def _window_sum(panel, window):
+    """
+    Trailing `window`-month sums, over fewer months at the start
+    (min_periods=1); integer panels give exact integer sums
+    """
+    csum = np.cumsum(panel, axis=1)
+    out = csum.copy()
+    out[:, window:] -= csum[:, :-window]
+    return out
+
+
+def _last_crime_month(y_true):
+    """Index of the latest month with a crime, up to every month (-1 if none yet)"""
+    month_idx = np.arange(y_true.shape[1])
+    return np.maximum.accumulate(np.where(y_true > 0, month_idx, -1), axis=1)
+
+
+def _months_since(last_crime, month_idx, cap=12):
+    """Months from last_crime to month_idx, capped (also when there was none)"""
+    return np.where(last_crime >= 0, np.minimum(month_idx - last_crime, cap), cap)
+
+
+def _zscore_by_month(panels, feats):
+    """
+    Z-score every month column of the feats panels in one reduction over the
+    stacked feature x LSOA x month array (population std, 0 replaced by 1)
+
+    Returns:
+        {feature: z-scored panel}, and the feature x month means and stds
+    """
+    stacked = np.stack([panels[c] for c in feats]).astype(float)
+    mu = stacked.mean(axis=1)
+    sigma = stacked.std(axis=1)
+    sigma[sigma == 0] = 1
+    stacked -= mu[:, None, :]
+    stacked /= sigma[:, None, :]
+    return dict(zip(feats, stacked)), (mu, sigma)
+
+
+def _dense_rank_desc(panel):
+    """Dense rank of every value within its month column, largest first"""
+    order = np.argsort(-panel, axis=0, kind='stable')
+    ranked = np.take_along_axis(panel, order, axis=0)
+    steps = np.ones(panel.shape, dtype=np.int64)
+    steps[1:] = ranked[1:] != ranked[:-1]
+    ranks = np.empty(panel.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.cumsum(steps, axis=0), axis=0)
+    return ranks
+
+
+def _panel_rows(lsoa_ids, ids):
+    """Panel row of every LSOA id (-1 for ids not in the panel)"""
+    return pd.Index(lsoa_ids).get_indexer(ids)
+
+
+def _spatial_lags(area_codes, lsoa_ids, panels):
+    """
+    Neighbour mean / max / sum panels of SPATIAL_LAG_COLUMNS, over the
+    contiguity graph of the panel's LSOAs (neighbours outside it are ignored)
+    """
+    graph = LsoaGraph.from_shapefile(SHP_PATH)
+    node_row = _panel_rows(lsoa_ids, area_codes.encode('LSOA', graph.codes, add_missing=False))
+    src, dst = node_row[graph.edge_index]
+    both = (src >= 0) & (dst >= 0)
+    spatial_lag = SpatialLag.from_edge_index(np.vstack([src[both], dst[both]]), len(lsoa_ids))
+    return {
+        f'nbr_{stat}_{c}': getattr(spatial_lag, stat)(panels[c])
+        for c in SPATIAL_LAG_COLUMNS for stat in STATS
+    }
+
+
+def _population_panels(dimension, rows, months):
+    """
+    Population and PopulationPerSqKm per LSOA x month (the values of the
+    month's year, NaN for years without data), and AreaSqKm per LSOA, for
+    the LSOAs at the given dimension table rows
+    """
+    years = dimension.years
+    year_col = pd.Index(years).get_indexer(months.year)   # -1: no data that year
+    panels = {}
+    for name in POPULATION_COLUMNS:
+        by_year = dimension.gather(rows, [f'{name} {year}' for year in years])
+        by_year = np.hstack([by_year, np.full((len(rows), 1), np.nan)])
+        panels[name] = by_year[:, year_col]
+    return panels, dimension.gather(rows, ['AreaSqKm'])[:, 0]
+
+
+def _long_table(area_codes, lsoa_ids, lsoa_ward, ward_names, months, panels, static):
+    """
+    Long LSOA x month table (LSOA-major, like the panel), with ids decoded
+    back to LSOA / ward codes and names
+    """
+    n_lsoas, n_months = len(lsoa_ids), len(months)
+    features = pd.DataFrame({
+        'LSOA code': np.repeat(area_codes.decode('LSOA', lsoa_ids), n_months),
+        'WD24CD': np.repeat(area_codes.decode('Ward', lsoa_ward), n_months),
+        'WD24NM': np.repeat(pd.Series(lsoa_ward).map(ward_names).to_numpy(), n_months),
+        'month': months[np.tile(np.arange(n_months), n_lsoas)]
+    })
+    for c, panel in panels.items():
+        features[c] = panel.ravel()
+    for c in static.columns:
+        features[c] = np.repeat(static[c].to_numpy(), n_months)
+    return features
+
+
+def _write_outputs(features, panels, months, dyn_feats, density_cols, ms_mean, ms_std, append=False):
+    """
+    Add the _z columns to the raw features and write them, and the stats
+    behind them, to the feature store; with append the rows go into a new
+    part after the existing ones
+    """
+    # Z-score the dynamic features per month, over the London LSOAs
+    z_panels, (mu, sigma) = _zscore_by_month(panels, dyn_feats)
+    for c, panel in z_panels.items():
+        features[c + '_z'] = panel.ravel()
+
+    # 'months_since_last_crime' is z-scored with its mean / std over all rows
+    ms_std = ms_std or 1
+    features['months_since_last_crime_z'] = ((panels['months_since_last_crime'] - ms_mean) / ms_std).ravel()
+
+    # Stats of every _z column, for z-scoring new data at inference time
+    stats = pd.DataFrame({
+        'feature': np.repeat(dyn_feats, len(months)),
+        'month': np.tile(months.astype(str), len(dyn_feats)),
+        'mean': mu.ravel(),
+        'std': sigma.ravel()
+    })
+    stats.loc[len(stats)] = ['months_since_last_crime', 'all', ms_mean, ms_std]
+    write_zscore_stats(stats, FEATURE_STORE, append=append)
+
+    # Define base output columns
+    base_cols = [
+        'LSOA code','WD24CD','WD24NM','month','y_true',
+        'crime_count_lag1','crime_count_lag3','crime_count_lag12',
+        *density_cols,'MedianPrice',
+        'month_sin','month_cos',
+        'rank_last_year','months_since_last_crime',
+        'roll_mean_6m','roll_std_6m','pct_change_1m','yoy_change',
+        'ward_mean_lag1','diff_from_ward_last_month', *NBR_COLUMNS,
+        'IMD Rank London', 'IMD Decile London', 'Population', 'PopulationPerSqKm', 'AreaSqKm'
+    ]
+    out_cols = [*base_cols, *[c + '_z' for c in dyn_feats], 'months_since_last_crime_z']
+
+    path = write_features(features[out_cols], FEATURE_STORE, append=append)
+    print(f"✅ {'Appended' if append else 'Saved'} {features.shape[0]} feature rows to {path}")
+
+
+def _save_feature_state(arrays, meta, counts, state_dir=FEATURE_STATE_DIR):
+    """Per-LSOA arrays (.npz), metadata (.json) and count panel read by update_month"""
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    np.savez(state_dir / "feature_state.npz", **arrays)
+    counts.save(state_dir / COUNTS_FILE)
+    with open(state_dir / "feature_state.json", "w") as f:
+        json.dump(meta, f, indent=2)
 
 
-def main():
-    INPUT_CSV = "London_burglaries_with_wards_correct_with_price.csv"
-    Z_OUTPUT = "lsoa_features_final.csv"
-    RAW_OUTPUT = "non_Z_score_feature_table.csv"
-    COMBINED_OUTPUT = "combined_features.csv"
-    SHP_PATH   = "LSOA_boundries/LSOA_2021_EW_BFE_V10.shp"
-    N195_PATH = "N195.csv"
-    POP_PATH = "Popdense.xlsx" 
+def _load_feature_state(state_dir=FEATURE_STATE_DIR):
+    state_dir = Path(state_dir)
+    if not (state_dir / "feature_state.json").exists():
+        raise FileNotFoundError(f"No feature state in {state_dir}; run a full build first")
+    with np.load(state_dir / "feature_state.npz") as npz:
+        arrays = dict(npz)
+    with open(state_dir / "feature_state.json") as f:
+        meta = json.load(f)
+    return arrays, meta, CountPanel.load(state_dir / COUNTS_FILE)
 
+
+def main(input_csv=INPUT_CSV):
     # 1) Load and parse CSV robustly
     df = pd.read_csv(
-        INPUT_CSV,
+        input_csv,
         parse_dates=["Month_dt", "Month"],
         dtype={"LSOA code": str},
         na_values={"MedianPrice": [":", "", "NA", "N/A"]},
         low_memory=False
     )
-    df['month'] = df['Month_dt'].dt.to_period('M')
-
-    # Extract ward code & name per LSOA (static)
-    ward_info = (
-        df[['LSOA code', 'WD24CD', 'WD24NM']]
-          .drop_duplicates(subset=['LSOA code'])
-    )
-
-    # 2) Crime counts per LSOA × month
-    crime_counts = (
-        df.groupby(['LSOA code', 'month'])
-          .size()
-          .rename('crime_count')
-          .reset_index()
-    )
 
-    # 3) Ensure every LSOA × month combination
-    all_ls = crime_counts['LSOA code'].unique()
-    all_months = pd.period_range(df['month'].min(), df['month'].max(), freq='M')
-    full_idx = pd.MultiIndex.from_product([all_ls, all_months], names=['LSOA code', 'month'])
-    crime_counts = (
-        crime_counts.set_index(['LSOA code', 'month'])
-                     .reindex(full_idx, fill_value=0)
-                     .reset_index()
-    )
-
-    # 4) Rename & create 1-month lag
-    crime_counts = crime_counts.rename(columns={'crime_count': 'y_true'})
-    crime_counts['crime_count_lag1'] = (
-        crime_counts.groupby('LSOA code')['y_true']
-                    .shift(1)
-                    .fillna(0)
-    )
-
-    # 5) Create additional lag features (3-month & 12-month)
-    for lag in [3, 12]:
-        crime_counts[f'crime_count_lag{lag}'] = (
-            crime_counts.groupby('LSOA code')['y_true']
-                        .shift(lag)
-                        .fillna(0)
-        )
-
-    # 6) Extract extra features
-    extras = (
-        df[['LSOA code', 'month', 'num_crimes_past_year_1km', 'MedianPrice']]
-          .drop_duplicates(subset=['LSOA code', 'month'])
-    )
-    features = pd.merge(crime_counts, extras, on=['LSOA code', 'month'], how='left')
-
-    # 7) Coerce to numeric
-    for col in ['num_crimes_past_year_1km', 'MedianPrice']:
-        features[col] = pd.to_numeric(features[col], errors='coerce')
+    # Rolling spatial count columns written by add_crimes_in_range.py
+    # (num_crimes_past_year_1km plus any other radius / window combinations)
+    density_cols = density_columns(df.columns)
+
+    # Carry LSOA & ward codes as dense int32 ids through every step;
+    # they are decoded back to code strings only for the output tables
+    area_codes = AreaCodeDictionary()
+    df['lsoa_id'] = area_codes.encode('LSOA', df['LSOA code'].to_numpy())
+    df['ward_id'] = area_codes.encode('Ward', df['WD24CD'].to_numpy())
+
+    # Extract ward id per LSOA (static) and ward names per ward id
+    lsoa_ward = df.drop_duplicates('lsoa_id').set_index('lsoa_id')['ward_id']
+    ward_names = df.drop_duplicates('ward_id').set_index('ward_id')['WD24NM']
+
+    # 2) Panel axes: every LSOA with a dated crime x every month. Rows are
+    #    sorted by LSOA code, not by id (whose order depends on the history
+    #    of data/area_codes.json), so the output and the population back-fill
+    #    below follow the same row order as the original sort_values.
+    #    Crimes without an LSOA code only extend the month range; they are
+    #    not an LSOA of the panel (and so not part of any per-month statistic)
+    dated = df[df['Month_dt'].notna()]
+    all_months = pd.period_range(dated['Month_dt'].min(), dated['Month_dt'].max(), freq='M')
+    dated = dated[dated['lsoa_id'] != MISSING_ID]
+    lsoa_ids = np.unique(dated['lsoa_id'].to_numpy())
+    lsoa_ids = lsoa_ids[np.argsort(area_codes.decode('LSOA', lsoa_ids), kind='stable')]
+    month_ordinal = (dated['Month_dt'].dt.year * 12 + dated['Month_dt'].dt.month - 1).to_numpy()
+    first_ordinal = all_months[0].year * 12 + all_months[0].month - 1
+    n_lsoas, n_months = len(lsoa_ids), len(all_months)
+    row = _panel_rows(lsoa_ids, dated['lsoa_id'].to_numpy())
+    col = month_ordinal - first_ordinal
+    lsoa_ward = lsoa_ward.reindex(lsoa_ids).to_numpy()
+
+    # 3) Crime counts per LSOA x month (sparse; zero where there were none)
+    counts = CountPanel.from_events(row, col, lsoa_ids, all_months[0], n_months)
+    y_true = counts.dense()
+    state = {'lsoa_ids': lsoa_ids, 'lsoa_ward': lsoa_ward}
+
+    # 4-5) 1, 3 and 12-month lags
+    panels = {f'crime_count_lag{lag}': counts.dense(lag=lag).astype(float) for lag in [1, 3, 12]}
+
+    # 6) Extra features (first row per LSOA x month), NaN where missing
+    extras = dated.assign(row=row, col=col).drop_duplicates(subset=['lsoa_id', 'col'])
+    for c in [*density_cols, 'MedianPrice']:
+        panel = np.full((n_lsoas, n_months), np.nan)
+        # 7) Coerce to numeric
+        panel[extras['row'].to_numpy(), extras['col'].to_numpy()] = pd.to_numeric(extras[c], errors='coerce')
+        panels[c] = panel
+
+    # 6b) Hotspot density at the LSOA centroid (kde_surface.py), if computed.
+    #     Lagged by one month: month m's surface contains month m's own crimes
+    kde_cols = []
+    if os.path.exists(KDE_PATH):
+        kde = pd.read_csv(KDE_PATH, dtype={'LSOA code': str})
+        kde_ids = area_codes.encode('LSOA', kde['LSOA code'].to_numpy(), add_missing=False)
+        kde_row = _panel_rows(lsoa_ids, kde_ids)
+        kde_months = pd.to_datetime(kde['month'], format='%Y-%m')
+        kde_col = (kde_months.dt.year * 12 + kde_months.dt.month).to_numpy() - first_ordinal
+        keep = (kde_row >= 0) & (kde_col >= 0) & (kde_col < n_months)
+        for c in [col_name for col_name in kde.columns if col_name.startswith('kde_')]:
+            panel = np.full((n_lsoas, n_months), np.nan)
+            panel[kde_row[keep], kde_col[keep]] = pd.to_numeric(kde[c], errors='coerce').to_numpy()[keep]
+            panels[c + '_lag1'] = panel
+            density_cols.append(c + '_lag1')
+            kde_cols.append(c)
 
     # 8) Impute missing extras: ffill per LSOA then 0
-    features = features.sort_values(['LSOA code', 'month'])
-    for col in ['num_crimes_past_year_1km', 'MedianPrice']:
-        features[col] = (
-            features.groupby('LSOA code')[col]
-                    .ffill()
-                    .fillna(0)
-        )
+    for c in [*density_cols, 'MedianPrice']:
+        panels[c] = np.nan_to_num(_ffill(panels[c]), nan=0.0)
 
     # 9) Drop initial month of data
-    first_month = df['month'].min()
-    features = features[features['month'] != first_month].reset_index(drop=True)
-
-    # 10) Attach IMD Decile and Rank London 
-    imd = (
-        pd.read_csv(
-            N195_PATH,
-            engine="python",        # tolerant parser
-            on_bad_lines="skip",    # drop footer rows with too many commas
-            dtype=str               # keep raw strings for now
-        )
-        .rename(columns=lambda c: c.strip())  # trim stray spaces in headers
-    )
-
-    # keep the two columns we want and one row per LSOA
-    imd = imd[['LSOA code', 'IMD Rank London', 'IMD Decile London']].drop_duplicates('LSOA code')
+    months = all_months[1:]
+    y_true = y_true[:, 1:]
+    panels = {c: panel[:, 1:] for c, panel in panels.items()}
+    n_months -= 1
 
-    # make the two metrics numeric; blanks → 0
-    for col in ['IMD Rank London', 'IMD Decile London']:
-        imd[col] = pd.to_numeric(imd[col], errors='coerce').fillna(0)
-
-    # merge into the main feature table
-    features = features.merge(imd, on='LSOA code', how='left')
+    # 10) Attach IMD Decile and Rank London from the cached LSOA dimension
+    #     table, gathered by LSOA id (NaN for LSOAs without an IMD row)
+    dimension = LsoaDimension(SHP_PATH, N195_PATH, POP_PATH)
+    dim_rows = dimension.rows(area_codes, lsoa_ids)
+    static = pd.DataFrame(dimension.gather(dim_rows, IMD_COLUMNS), columns=IMD_COLUMNS)
 
     # 11) Attach annual population metrics
-    # 1) read the sheet (first sheet assumed)
-    pop = (
-        pd.read_excel(POP_PATH, dtype={'LSOA 2021 Code': str})
-        .rename(columns=lambda c: c.strip())          # trim header spaces
-        .dropna(subset=['LSOA 2021 Code'])            # guard against blank rows
-    )
-
-    # 2) identify the yearly columns
-    pop_cols  = [c for c in pop.columns if c.endswith("Pop")]
-    dens_cols = [c for c in pop.columns if c.endswith("PpSqKm")]
-
-    # 3) reshape to long format  →  one row per (LSOA, year)
-    pop_long = (
-        pop.melt(
-            id_vars=['LSOA 2021 Code'], value_vars=pop_cols,
-            var_name='year_col', value_name='Population'
-        )
-    )
-    pop_long['year'] = pop_long['year_col'].str.extract(r'(\d{4})').astype(int)
-    pop_long = pop_long.drop(columns='year_col')
-
-    dens_long = (
-        pop.melt(
-            id_vars=['LSOA 2021 Code'], value_vars=dens_cols,
-            var_name='year_col', value_name='PopulationPerSqKm'
-        )
-    )
-    dens_long['year'] = dens_long['year_col'].str.extract(r'(\d{4})').astype(int)
-    dens_long = dens_long.drop(columns='year_col')
-
-    # 4) merge the two metrics side-by-side
-    pop_full = (
-        pop_long.merge(dens_long, on=['LSOA 2021 Code', 'year'], how='inner')
-                .rename(columns={'LSOA 2021 Code': 'LSOA code'})
-    )
-
-    # 5) bring year into the crime-feature table
-    features['year'] = features['month'].dt.year
-
-    # 6) merge annual population onto every month row
-    features = features.merge(
-        pop_full, on=['LSOA code', 'year'], how='left'
-    )
-
-    # 7) carry 2022 values forward to 2023-2025 (and back-fill if needed)
-    features = features.sort_values(['LSOA code', 'year'])
-    for col in ['Population', 'PopulationPerSqKm']:
-        features[col] = (
-            features.groupby('LSOA code')[col]
-                    .ffill()            # forward-fill to future years
-                    .bfill()            # (unlikely) back-fill if 2011 missing
-                    .astype(float)
-        )
-    areas = (
-        pop[['LSOA 2021 Code', 'AreaSqKm']]
-        .rename(columns={'LSOA 2021 Code': 'LSOA code',
-                        'AreaSqKm': 'AreaSqKm'})
-        .drop_duplicates('LSOA code')
-    )
-    features = features.merge(areas, on='LSOA code', how='left') 
-
-    # 8) clean-up helper column
-    features = features.drop(columns='year')
+    population, area = _population_panels(dimension, dim_rows, months)
+    static['AreaSqKm'] = area
+    for name, panel in population.items():
+        # 4) carry 2022 values forward to 2023-2025 per LSOA, then back-fill
+        #    whatever is left from the following rows (LSOA-major, by code)
+        panels[name] = pd.Series(_ffill(panel).ravel()).bfill().to_numpy().reshape(panel.shape)
+
+    # Trailing values --update carries forward (before any z-scoring)
+    state['last_extras'] = np.column_stack([panels[c][:, -1] for c in [*density_cols, 'MedianPrice']])
+    state['last_population'] = np.column_stack([panels[c][:, -1] for c in POPULATION_COLUMNS])
+    state['last_crime'] = _last_crime_month(y_true)[:, -1]
+    state['static'] = static.to_numpy(dtype=float)
 
     # 12) Normalize dynamic features per month safely (avoid division by zero)
     dyn_feats = [
         'crime_count_lag1', 'crime_count_lag3', 'crime_count_lag12',
-        'num_crimes_past_year_1km', 'MedianPrice'
+        *density_cols, 'MedianPrice'
     ]
-    for col in dyn_feats:
-        group = features.groupby('month')[col]
-        mu = group.transform('mean')
-        sigma = group.transform(lambda x: x.std(ddof=0)).replace(0, 1)
-        features[col] = (features[col] - mu) / sigma
+    panels.update(_zscore_by_month(panels, dyn_feats)[0])
 
     # 13) Cyclical month encoding
-    features['month_num'] = features['month'].dt.month
-    features['month_sin'] = np.sin(2 * np.pi * features['month_num'] / 12)
-    features['month_cos'] = np.cos(2 * np.pi * features['month_num'] / 12)
-
-    # 14) Filter LSOAs by intersecting the Greater London bbox
-    # 14a) load full UK LSOA shapefile in British National Grid
-    gdf = gpd.read_file(SHP_PATH).to_crs(epsg=27700)
-    # 14b) define Greater London bounding box in WGS84
-    min_lon, min_lat, max_lon, max_lat = -0.5103, 51.2868, 0.3340, 51.6919
-    london_box = (
-        gpd.GeoSeries([box(min_lon, min_lat, max_lon, max_lat)], crs="EPSG:4326")
-           .to_crs(epsg=27700)
-           .iloc[0]
-    )
-    # 14c) pick only LSOAs whose geometry intersects the London box
-    london_lsoas = gdf[gdf.geometry.intersects(london_box)]
-    valid_codes = set(london_lsoas['LSOA21CD'])
-    before = len(features)
-    features = features[features['LSOA code'].isin(valid_codes)].reset_index(drop=True)
-    after = len(features)
-    print(f"Filtered out {before-after} rows outside Greater London bbox")
+    month_num = np.asarray(months.month)
+    month_sin = np.sin(2 * np.pi * month_num / 12)
+    month_cos = np.cos(2 * np.pi * month_num / 12)
+
+    # 14) Filter LSOAs by intersecting the Greater London bbox (a purely
+    #     geographic filter: crimes without an LSOA code never reach the panel)
+    keep = dimension.london(dim_rows)
+    state['keep'] = keep
+    print(f"Filtered out {(~keep).sum() * n_months} rows outside Greater London bbox")
+    lsoa_ids, lsoa_ward, y_true = lsoa_ids[keep], lsoa_ward[keep], y_true[keep]
+    panels = {c: panel[keep] for c, panel in panels.items()}
+    static = static[keep]
+    n_lsoas = len(lsoa_ids)
 
     # ──────────────────────────────────────────────────────────────────
     # 15) ADDITIONAL FEATURES: 12-month ranking + months-since-last-crime (capped + z-scored)
     # ──────────────────────────────────────────────────────────────────
 
-    # (a) Ensure sorted by LSOA & month
-    features = features.sort_values(['LSOA code', 'month'])
     # 12a) 12-month rolling sum (for rank)
-    features['crimes_last_12m'] = (
-        features.groupby('LSOA code')['y_true']
-                .rolling(window=12, min_periods=1)
-                .sum().reset_index(level=0, drop=True)
-    )
-    features['rank_last_year'] = (
-        features.groupby('month')['crimes_last_12m']
-                .rank(method='dense', ascending=False).astype(int)
-    )
-    # 12b) Months since last crime (RAW VALUE AT THIS POINT)
-    features['last_crime_month'] = features['month'].where(features['y_true'] > 0)
-    features['last_crime_month'] = (
-        features.groupby('LSOA code')['last_crime_month'].ffill()
-    )
-    delta = features['month'] - features['last_crime_month']
-    features['months_since_last_crime'] = (
-        delta.map(lambda x: x.n if pd.notnull(x) else np.nan)
-             .astype('Int64')
-             .fillna(12).clip(upper=12)
-    )
+    crimes_last_12m = _window_sum(y_true, 12)
+    panels['rank_last_year'] = _dense_rank_desc(crimes_last_12m)
+    # 12b) Months since last crime, capped at 12 (RAW VALUE AT THIS POINT)
+    month_idx = np.arange(n_months)
+    panels['months_since_last_crime'] = _months_since(_last_crime_month(y_true), month_idx)
     # NOTE: 'months_since_last_crime' is RAW at this point. Z-scoring happens later.
 
-    # Merge static ward info
-    features = features.merge(ward_info, on='LSOA code', how='left')
-
     # 13) Derived rolling & change metrics
     # 13a) 6-month rolling mean & std of y_true
-    features['roll_mean_6m'] = (
-        features.groupby('LSOA code')['y_true']
-                .rolling(window=6, min_periods=1)
-                .mean().reset_index(level=0, drop=True)
-    )
-    features['roll_std_6m'] = (
-        features.groupby('LSOA code')['y_true']
-                .rolling(window=6, min_periods=1)
-                .std(ddof=0).reset_index(level=0, drop=True).fillna(0)
-    )
-    # 13b) Month-over-month percent change
-    features['pct_change_1m'] = (
-        features.groupby('LSOA code')['y_true']
-                .pct_change(1).fillna(0)
-    )
+    #     (counts are integers, so n * sum(x^2) - sum(x)^2 is exact)
+    window_len = np.minimum(month_idx + 1, 6)
+    roll_sum = _window_sum(y_true, 6)
+    roll_sq_sum = _window_sum(y_true.astype(float) ** 2, 6)
+    panels['roll_mean_6m'] = roll_sum / window_len
+    panels['roll_std_6m'] = np.sqrt(window_len * roll_sq_sum - roll_sum ** 2) / window_len
+    # 13b) Month-over-month percent change (0 for the first month and 0 -> 0)
+    pct_change = np.zeros((n_lsoas, n_months))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_change[:, 1:] = y_true[:, 1:] / y_true[:, :-1] - 1
+    panels['pct_change_1m'] = np.where(np.isnan(pct_change), 0, pct_change)
     # 13c) Year-over-year change
-    features['yoy_change'] = features['y_true'] - features['crime_count_lag12']
+    panels['yoy_change'] = y_true - panels['crime_count_lag12']
 
     # 13d) Ward-level mean of last month & deviation
-    ward_month = (
-        features.groupby(['WD24CD','month'])['y_true']
-                .mean().rename('ward_mean').reset_index()
-    )
-    ward_month['ward_mean_lag1'] = (
-        ward_month.groupby('WD24CD')['ward_mean'].shift(1).fillna(0)
-    )
-    features = features.merge(
-        ward_month[['WD24CD','month','ward_mean_lag1']],
-        on=['WD24CD','month'], how='left'
-    )
-    features['diff_from_ward_last_month'] = (
-        features['y_true'] - features['ward_mean_lag1']
+    wards, ward_pos = np.unique(lsoa_ward, return_inverse=True)
+    ward_sum = np.zeros((len(wards), n_months))
+    np.add.at(ward_sum, ward_pos, y_true)
+    ward_mean = ward_sum / np.bincount(ward_pos)[:, None]
+    panels['ward_mean_lag1'] = _lag(ward_mean, 1)[ward_pos]
+    panels['diff_from_ward_last_month'] = y_true - panels['ward_mean_lag1']
+    # 13e) Neighbour mean / max / sum of the lags and rolling stats (as they
+    #      are stored: the lags z-scored in step 12, the rolling stats raw)
+    panels.update(_spatial_lags(area_codes, lsoa_ids, panels))
+    panels['y_true'] = y_true
+    panels['month_sin'] = np.broadcast_to(month_sin, y_true.shape)
+    panels['month_cos'] = np.broadcast_to(month_cos, y_true.shape)
+
+    features = _long_table(area_codes, lsoa_ids, lsoa_ward, ward_names, months, panels, static)
+
+    # Z-score 'months_since_last_crime' over all rows
+    msl = panels['months_since_last_crime']
+    ms_stats = {'count': int(msl.size), 'sum': int(msl.sum()), 'sum_sq': int((msl ** 2).sum())}
+    _write_outputs(features, panels, months, dyn_feats, density_cols, msl.mean(), msl.std())
+
+    _save_feature_state(state, {
+        'first_month': str(all_months[0]),
+        'last_month': str(months[-1]),
+        'n_feature_months': n_months,
+        'density_cols': density_cols,
+        'kde_cols': kde_cols,
+        'static_cols': static.columns.tolist(),
+        'ward_names': {str(ward): name if isinstance(name, str) else None for ward, name in ward_names.items()},
+        'months_since_last_crime': ms_stats
+    }, counts)
+
+
+def update_month(month, input_csv=INPUT_CSV, state_dir=FEATURE_STATE_DIR):
+    """
+    Append the feature rows of one newly ingested month to the feature
+    store, from the trailing state of the last build / update instead of
+    rebuilding the whole panel.
+
+    Only that month's rows are read from input_csv. Rows already written are
+    not rewritten, so their months_since_last_crime z-scores keep the
+    mean / std of the run that wrote them; the new month uses the stats
+    over every row so far.
+    """
+    state, meta, counts = _load_feature_state(state_dir)
+    month = pd.Period(month, freq='M')
+    expected = pd.Period(meta['last_month'], freq='M') + 1
+    if month != expected:
+        raise ValueError(f"Features run to {meta['last_month']}; the next month to add is {expected}, not {month}")
+
+    lsoa_ids, lsoa_ward, keep = state['lsoa_ids'], state['lsoa_ward'], state['keep']
+    if (lsoa_ids == MISSING_ID).any():
+        # States of older builds kept crimes without an LSOA code as a panel
+        # row, which would enter this month's per-month z-score stats
+        raise ValueError(f"Feature state in {state_dir} has a row for crimes without an LSOA code; "
+                         "run a full build first")
+    # Counts of the 12 months before, zero before the first month
+    recent = counts.dense(month - 12, month - 1)
+    n_lsoas, n_feature_months = len(lsoa_ids), meta['n_feature_months']
+    density_cols = meta['density_cols']
+    kde_lag_cols = [c + '_lag1' for c in meta['kde_cols']]
+    input_cols = [c for c in density_cols if c not in kde_lag_cols] + ['MedianPrice']
+    area_codes = AreaCodeDictionary()
+
+    # 1) This month's crimes, on the LSOAs of the last full build
+    df = pd.read_csv(
+        input_csv,
+        usecols=['Month_dt', 'LSOA code', *input_cols],
+        parse_dates=['Month_dt'],
+        dtype={"LSOA code": str},
+        na_values={"MedianPrice": [":", "", "NA", "N/A"]},
+        low_memory=False
     )
-
-    # --- Prepare outputs from the fully-featured RAW DataFrame ---
-    # At this point, 'features' contains all raw (non-z-scored) features
-    raw_features_df = features.copy()
-    lsoa_features_df = features.copy()
-    combined_features_df = features.copy()
-
-    # Define dynamic features for z-scoring
+    df = df[(df['Month_dt'].dt.to_period('M') == month) & df['LSOA code'].notna()]
+    ids = area_codes.encode('LSOA', df['LSOA code'].to_numpy(), add_missing=False)
+    row = _panel_rows(lsoa_ids, ids)
+    known = row >= 0
+    if not known.all():
+        print(f"⚠️ Skipped {(~known).sum()} crimes in LSOAs without earlier crimes; run a full build to add them")
+    df, row = df[known], row[known]
+    y_true = np.bincount(row, minlength=n_lsoas)
+
+    # 2) 1, 3 and 12-month lags (recent ends with the previous month)
+    values = {f'crime_count_lag{lag}': recent[:, 12 - lag].astype(float) for lag in [1, 3, 12]}
+
+    # 3) Extra features (first row per LSOA), else carried forward
+    first = ~pd.Series(row).duplicated().to_numpy()
+    last_extras = dict(zip([*density_cols, 'MedianPrice'], state['last_extras'].T))
+    new_extras = {}
+    for c in input_cols:
+        new_extras[c] = np.full(n_lsoas, np.nan)
+        new_extras[c][row[first]] = pd.to_numeric(df[c], errors='coerce').to_numpy()[first]
+    if kde_lag_cols and os.path.exists(KDE_PATH):
+        kde = pd.read_csv(KDE_PATH, dtype={'LSOA code': str})
+        kde = kde[kde['month'] == str(month - 1)]
+        kde_ids = area_codes.encode('LSOA', kde['LSOA code'].to_numpy(), add_missing=False)
+        kde_row = _panel_rows(lsoa_ids, kde_ids)
+        found = kde_row >= 0
+        for c in meta['kde_cols']:
+            new_extras[c + '_lag1'] = np.full(n_lsoas, np.nan)
+            new_extras[c + '_lag1'][kde_row[found]] = pd.to_numeric(kde[c], errors='coerce').to_numpy()[found]
+    for c, last in last_extras.items():
+        new = new_extras.get(c, np.full(n_lsoas, np.nan))
+        values[c] = np.where(np.isnan(new), last, new)
+
+    # 4) Population of the month's year, else carried forward
+    dimension = LsoaDimension(SHP_PATH, N195_PATH, POP_PATH)
+    population, _ = _population_panels(dimension, dimension.rows(area_codes, lsoa_ids),
+                                       pd.period_range(month, periods=1, freq='M'))
+    for j, c in enumerate(POPULATION_COLUMNS):
+        values[c] = np.where(np.isnan(population[c][:, 0]), state['last_population'][:, j], population[c][:, 0])
+    new_state = {
+        'last_extras': np.column_stack([values[c] for c in last_extras]),
+        'last_population': np.column_stack([values[c] for c in POPULATION_COLUMNS])
+    }
+
+    # 5) Normalize dynamic features over all LSOAs, then keep the London ones
     dyn_feats = [
         'crime_count_lag1', 'crime_count_lag3', 'crime_count_lag12',
-        'num_crimes_past_year_1km', 'MedianPrice'
+        *density_cols, 'MedianPrice'
     ]
-
-    # Z-score 'lsoa_features_df' in place
-    for col in dyn_feats:
-        group = lsoa_features_df.groupby('month')[col]
-        mu = group.transform('mean')
-        sigma = group.transform(lambda x: x.std(ddof=0)).replace(0, 1)
-        lsoa_features_df[col] = (lsoa_features_df[col] - mu) / sigma
-
-    # Z-score 'months_since_last_crime' in place for lsoa_features_df
-    ms_mean_lsoa = lsoa_features_df['months_since_last_crime'].mean()
-    ms_std_lsoa = lsoa_features_df['months_since_last_crime'].std(ddof=0) or 1
-    lsoa_features_df['months_since_last_crime'] = (
-        (lsoa_features_df['months_since_last_crime'] - ms_mean_lsoa) / ms_std_lsoa
-    )
-
-    # Add _z columns to 'combined_features_df' (using its raw values for calculation)
-    for col in dyn_feats:
-        group = combined_features_df.groupby('month')[col]
-        mu = group.transform('mean')
-        sigma = group.transform(lambda x: x.std(ddof=0)).replace(0, 1)
-        combined_features_df[col + '_z'] = (combined_features_df[col] - mu) / sigma
-
-    # Add 'months_since_last_crime_z' to 'combined_features_df'
-    ms_mean_combined = combined_features_df['months_since_last_crime'].mean()
-    ms_std_combined = combined_features_df['months_since_last_crime'].std(ddof=0) or 1
-    combined_features_df['months_since_last_crime_z'] = (
-        (combined_features_df['months_since_last_crime'] - ms_mean_combined) / ms_std_combined
-    )
-
-    # Define base output columns
-    base_cols = [
-        'LSOA code','WD24CD','WD24NM','month','y_true',
-        'crime_count_lag1','crime_count_lag3','crime_count_lag12',
-        'num_crimes_past_year_1km','MedianPrice',
-        'month_sin','month_cos',
-        'rank_last_year','months_since_last_crime',
-        'roll_mean_6m','roll_std_6m','pct_change_1m','yoy_change',
-        'ward_mean_lag1','diff_from_ward_last_month',
-        'IMD Rank London', 'IMD Decile London', 'Population', 'PopulationPerSqKm', 'AreaSqKm'
-    ]
-
-    # Save raw features
-    raw_features_df[base_cols].to_csv(RAW_OUTPUT, index=False)
-    print(f"✅ Saved raw features to {RAW_OUTPUT} ({raw_features_df.shape[0]} rows)")
-
-    # Save z-scored features
-    lsoa_features_df[base_cols].to_csv(Z_OUTPUT, index=False)
-    print(f"✅ Saved z-scored features to {Z_OUTPUT} ({lsoa_features_df.shape[0]} rows)")
-
-    # Save combined features
-    combined_out_cols = base_cols.copy()
-    combined_out_cols.extend([col + '_z' for col in dyn_feats])
-    combined_out_cols.append('months_since_last_crime_z')
-
-    print("Columns in features before copy:", features.columns.tolist())
-    print("Columns in combined_features_df before saving:", combined_features_df.columns.tolist())
-
-    combined_features_df[combined_out_cols].to_csv(COMBINED_OUTPUT, index=False)
-    print(f"✅ Saved combined features to {COMBINED_OUTPUT} ({combined_features_df.shape[0]} rows)")
+    panels = {c: v[:, None] for c, v in values.items()}
+    panels.update(_zscore_by_month(panels, dyn_feats)[0])
+    panels = {c: panel[keep] for c, panel in panels.items()}
+    y = y_true[keep]
+    past = recent[keep]
+
+    # 6) Rank of the 12-month sum, months since last crime
+    crimes_last_12m = past[:, 12 - min(n_feature_months, 11):].sum(axis=1) + y
+    panels['rank_last_year'] = _dense_rank_desc(crimes_last_12m[:, None])
+    last_crime = np.where(y_true > 0, n_feature_months, state['last_crime'])
+    msl = _months_since(last_crime, n_feature_months)[keep]
+    panels['months_since_last_crime'] = msl[:, None]
+
+    # 7) Rolling & change metrics
+    window = past[:, 12 - min(n_feature_months, 5):]
+    window_len = window.shape[1] + 1
+    roll_sum = window.sum(axis=1) + y
+    roll_sq_sum = (window.astype(float) ** 2).sum(axis=1) + y.astype(float) ** 2
+    panels['roll_mean_6m'] = (roll_sum / window_len)[:, None]
+    panels['roll_std_6m'] = (np.sqrt(window_len * roll_sq_sum - roll_sum ** 2) / window_len)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_change = y / past[:, -1] - 1
+    panels['pct_change_1m'] = np.where(np.isnan(pct_change), 0, pct_change)[:, None]
+    panels['yoy_change'] = y[:, None] - panels['crime_count_lag12']
+    wards, ward_pos = np.unique(lsoa_ward[keep], return_inverse=True)
+    ward_mean = np.bincount(ward_pos, weights=past[:, -1]) / np.bincount(ward_pos)
+    panels['ward_mean_lag1'] = ward_mean[ward_pos][:, None]
+    panels['diff_from_ward_last_month'] = y[:, None] - panels['ward_mean_lag1']
+    panels.update(_spatial_lags(area_codes, lsoa_ids[keep], panels))
+    panels['y_true'] = y[:, None]
+    panels['month_sin'] = np.full((len(y), 1), np.sin(2 * np.pi * month.month / 12))
+    panels['month_cos'] = np.full((len(y), 1), np.cos(2 * np.pi * month.month / 12))
+
+    # 8) Append the month's rows; months_since_last_crime stats include them
+    static = pd.DataFrame(state['static'][keep], columns=meta['static_cols'])
+    ward_names = {int(ward): name for ward, name in meta['ward_names'].items()}
+    features = _long_table(area_codes, lsoa_ids[keep], lsoa_ward[keep], ward_names,
+                           pd.period_range(month, periods=1, freq='M'), panels, static)
+    ms_stats = meta['months_since_last_crime']
+    ms_stats['count'] += int(msl.size)
+    ms_stats['sum'] += int(msl.sum())
+    ms_stats['sum_sq'] += int((msl ** 2).sum())
+    ms_mean = ms_stats['sum'] / ms_stats['count']
+    ms_std = np.sqrt(max(ms_stats['sum_sq'] / ms_stats['count'] - ms_mean ** 2, 0))
+    _write_outputs(features, panels, pd.period_range(month, periods=1, freq='M'), dyn_feats, density_cols,
+                   ms_mean, ms_std, append=True)
+
+    state.update(new_state)
+    counts.append_month(y_true)
+    state['last_crime'] = last_crime
+    meta['last_month'] = str(month)
+    meta['n_feature_months'] = n_feature_months + 1
+    _save_feature_state(state, meta, counts, state_dir)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--update', metavar='YYYY-MM', default=None,
+                        help="append only this newly ingested month (the one after the last build / update)")
+    parser.add_argument('--input', default=INPUT_CSV)
+    args = parser.parse_args()
+    if args.update:
+        update_month(args.update, args.input)
+    else:
+        main(args.input)
@@ -8,9 +8,20 @@ import matplotlib.pyplot as plt
 import joblib
 import os
 
-# ─── 1) Load & preprocess the CSV ────────────────────────────────────────────────
-csv_path = r"combined_features.csv"
-df = pd.read_csv(csv_path)
+from feature_store import read_features
+
+# ─── 1) Load & preprocess the features ──────────────────────────────────────────
+# Only the model's columns are read from the feature store (plus any column
+# with missing values, so the dropna() below drops the same rows as before)
+store_columns = [
+    'LSOA code','WD24CD','WD24NM','month','y_true',
+    'crime_count_lag1','crime_count_lag3','crime_count_lag12',
+    'num_crimes_past_year_1km','MedianPrice','month_sin','month_cos',
+    'rank_last_year','months_since_last_crime',
+    'crime_count_lag1_z','crime_count_lag3_z','crime_count_lag12_z',
+    'num_crimes_past_year_1km_z','MedianPrice_z','months_since_last_crime_z'
+]
+df = read_features(store_columns, with_nullable=True)
 
 # Keep original string columns for export
 original_cols = df[['LSOA code', 'WD24CD', 'WD24NM', 'month']].copy()
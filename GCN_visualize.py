@@ -1,12 +1,12 @@
 import pandas as pd
 import geopandas as gpd
-import networkx as nx
 import torch
 import matplotlib.pyplot as plt
 from torch_geometric.data import Data
-from torch_geometric.utils import from_networkx
 from sklearn.metrics import mean_squared_error, r2_score
 
+from lsoa_graph import LsoaGraph
+
 # 1) Rebuild filtered graph exactly as in training
 shp_path = r"C:\Coding\CBL-London-Crime-\LSOA_boundries\LSOA_2021_EW_BFE_V10.shp"
 feat_df = pd.read_csv("lsoa_features.csv")
@@ -15,23 +15,14 @@ code_col = next(c for c in feat_df.columns if "LSOA" in c.upper())
 feat_df = feat_df.rename(columns={code_col: "LSOA21CD"})
 feat_df["month"] = pd.to_datetime(feat_df["month"]).dt.to_period("M")
 
-full_gdf = gpd.read_file(shp_path).to_crs(epsg=27700)
-codes = feat_df["LSOA21CD"].unique().tolist()
-gdf = full_gdf[full_gdf["LSOA21CD"].isin(codes)].reset_index(drop=True)
+# contiguity graph (cached per shapefile, see lsoa_graph.py)
+graph = LsoaGraph.from_shapefile(shp_path).subgraph(feat_df["LSOA21CD"].unique())
 
-# build contiguity graph
-sindex = gdf.sindex
-G = nx.Graph()
-for idx, row in gdf.iterrows():
-    G.add_node(idx, lsoa_code=row["LSOA21CD"])
-for idx, geom in gdf.geometry.items():
-    for nbr in sindex.intersection(geom.bounds):
-        if nbr!=idx and geom.touches(gdf.geometry.iloc[nbr]):
-            G.add_edge(idx, nbr)
+edge_index= torch.from_numpy(graph.edge_index)
+node_codes= graph.codes.tolist()
 
-pyg       = from_networkx(G)
-edge_index= pyg.edge_index
-node_codes= gdf["LSOA21CD"].tolist()
+# polygons of the graph's LSOAs, in node order, for the residual map
+gdf = gpd.read_file(shp_path).to_crs(epsg=27700).set_index("LSOA21CD").reindex(node_codes).reset_index()
 
 # 2) Prepare test Data for 2016-01
 feat_cols = [
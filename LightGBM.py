@@ -10,12 +10,22 @@ import pandas as pd
 import lightgbm as lgb
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 
+from feature_store import read_features
+
 warnings.filterwarnings("ignore", category=FutureWarning)
 
 # ----------------------------------------------------------------------
 # Configuration
 # ----------------------------------------------------------------------
-INPUT_CSV = "lsoa_features_final.csv"   # <- path to your final feature file
+# Model inputs, read z-scored from the feature store (Build_features_table.py)
+FEATURE_COLS = [
+    "crime_count_lag1", "crime_count_lag3", "crime_count_lag12",
+    "num_crimes_past_year_1km", "MedianPrice",
+    "month_sin", "month_cos",
+    "rank_last_year", "months_since_last_crime",
+    "IMD Decile London", "IMD Rank London",
+    "AreaSqKm", "Population", "PopulationPerSqKm"
+]
 
 # ----------------------------------------------------------------------
 # Helper: evaluation metrics
@@ -43,18 +53,12 @@ def evaluate(y_true, y_pred) -> dict:
 def main() -> None:
 
     # ---------- 1) Load & filter ----------
-    df = pd.read_csv(INPUT_CSV, parse_dates=["month"])
+    df = read_features(["month", "y_true", *FEATURE_COLS], z_scored=True)
+    df["month"] = pd.to_datetime(df["month"])
     df = df[(df["month"] >= "2011-01-01") & (df["month"] <= "2019-12-31")]
 
     # ---------- 2) Feature list ----------
-    feature_cols = [
-        "crime_count_lag1", "crime_count_lag3", "crime_count_lag12",
-        "num_crimes_past_year_1km", "MedianPrice",
-        "month_sin", "month_cos",
-        "rank_last_year", "months_since_last_crime",
-        "IMD Decile London", "IMD Rank London",
-        "AreaSqKm", "Population", "PopulationPerSqKm"
-    ]
+    feature_cols = FEATURE_COLS
 
     # Drop any rows with missing target or features
     df = df.dropna(subset=["y_true"] + feature_cols)
@@ -1,6 +1,7 @@
 import os
 <<<<<<< HEAD
 import sys
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import json
@@ -22,10 +23,12 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 import time
 import sys
+import numpy as np
 
 # Add the project root to Python path for imports
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
-from ProjectDashboard.backend.optimized_csv import CSVIndexManager, load_burglary_data, aggregate_by_area
+from ProjectDashboard.backend.optimized_csv import CSVIndexManager, CSVSchemaRegistry, load_burglary_data, aggregate_by_area
+from area_codes import AreaCodeDictionary
 >>>>>>> e780b3354e9a96e159021bfbaf01d17031f477eb
 
 # Suppress shapely warnings
@@ -43,6 +46,7 @@ OUTPUTS_DIR = ROOT_DIR / "outputs"
 ACTUAL_CSV = OUTPUTS_DIR / "actual_past_year_500m.csv"
 PREDICTIONS_CSV = OUTPUTS_DIR / "next_month_predictions.csv"
 LSOA_GRAPH = ROOT_DIR / "london_lsoa_graph.gexf"
+LSOA_GRAPH_NPZ = ROOT_DIR / "london_lsoa_graph.npz"
 LSOA_SHP = ROOT_DIR / "LSOA_boundries" / "LSOA_2021_EW_BFE_V10.shp"
 
 # Global variable to store node positions so they're consistent across API calls
@@ -182,9 +186,16 @@ def fallback_to_graph():
     global NODE_POSITIONS
     
     try:
-        # Load the graph
-        G = nx.read_gexf(str(LSOA_GRAPH))
-        print(f"Falling back to graph with {len(G.nodes())} nodes and {len(G.edges())} edges")
+        # Load the graph: the edge-index file written by map_to_graph.py, else the GEXF export
+        if LSOA_GRAPH_NPZ.exists():
+            with np.load(LSOA_GRAPH_NPZ) as graph:
+                node_codes = dict(enumerate(graph['codes'].tolist()))
+                n_edges = graph['edge_index'].shape[1] // 2
+        else:
+            G = nx.read_gexf(str(LSOA_GRAPH))
+            node_codes = {node: attrs.get('lsoa_code', f"LSOA_{node}") for node, attrs in G.nodes(data=True)}
+            n_edges = len(G.edges())
+        print(f"Falling back to graph with {len(node_codes)} nodes and {n_edges} edges")
         
         # Create a visualization of the graph
         features = []
@@ -194,7 +205,7 @@ def fallback_to_graph():
         if not NODE_POSITIONS:
             # Create a force-directed layout for visualization
             pos = {}
-            nodes = list(G.nodes())
+            nodes = list(node_codes)
             n = len(nodes)
             
             # Use a deterministic seed for reproducibility
@@ -219,7 +230,7 @@ def fallback_to_graph():
             pos = NODE_POSITIONS
         
         # Create polygon features for each LSOA
-        for node in G.nodes():
+        for node in node_codes:
             if node in pos:
                 x, y = pos[node]
                 size = 0.005  # Roughly 500m at London's latitude
@@ -235,8 +246,8 @@ def fallback_to_graph():
                 # Close the polygon
                 hex_points.append(hex_points[0])
                 
-                # Get LSOA code from node attributes
-                lsoa_code = G.nodes[node].get('lsoa_code', f"LSOA_{node}")
+                # LSOA code of the node
+                lsoa_code = node_codes[node]
                 
                 features.append({
                     "type": "Feature",
@@ -402,6 +413,32 @@ CRIME_DATA_CACHE = {}
 # Initialize CSV index manager for faster file access
 CSV_INDEX_MANAGER = CSVIndexManager(YEARLY_BURGLARIES_DIR)
 
+# Registered column layout of every CSV we read (persisted next to the indices)
+CSV_SCHEMA_REGISTRY = CSVSchemaRegistry(YEARLY_BURGLARIES_DIR)
+
+# LSOA/Ward code -> int32 id lookup of this server, built in memory from the
+# codes of the boundaries it serves (no dependency on data/area_codes.json);
+# counts and caches are keyed by id and codes are only turned back into strings
+# in the API responses. Crime / prediction codes are looked up with
+# add_missing=False: a code outside the boundaries can't be drawn, so it counts
+# as no area
+AREA_CODES = AreaCodeDictionary(codes_file=None)
+
+# Crime counts indexed by area id; empty when there is no data
+NO_COUNTS = np.zeros(0)
+
+# Candidate property names holding the area code in each boundary file
+BOUNDARY_CODE_PROPERTIES = {
+    'LSOA': ['LSOA21CD', 'LSOA11CD', 'lsoa_code'],
+    'Ward': ['GSS_CODE', 'Ward_Code', 'NAME', 'ward_code']
+}
+
+# Boundary sets whose codes make up the ids of each boundary type
+BOUNDARY_DETAIL_LEVELS = {
+    'LSOA': ['medium', 'high'],
+    'Ward': ['low']
+}
+
 def get_cached_boundaries(detail_level="medium"):
     """Get boundaries from cache or load if not cached. Shared across all endpoints."""
     global LONDON_BOUNDARIES_HIGH, LONDON_BOUNDARIES_MEDIUM, LONDON_BOUNDARIES_LOW
@@ -428,7 +465,8 @@ def initialize_boundaries():
         
         # Load CSV indices for faster file access
         print("Checking CSV indices...")
-        if not CSV_INDEX_MANAGER.indices:
+        if not CSV_INDEX_MANAGER.indices or \
+           any('month_offsets' not in index for index in CSV_INDEX_MANAGER.indices.values()):
             print("Building CSV indices for yearly files (first run)...")
             CSV_INDEX_MANAGER.build_indices(rebuild=False)
             print(f"Created indices for {len(CSV_INDEX_MANAGER.indices)} files")
@@ -516,6 +554,9 @@ def load_london_boundaries(detail_level="medium"):
         # Convert to GeoJSON and cache the result
         boundaries_geojson = json.loads(london_gdf_web.to_json())
         
+        # Register the boundary codes: they are the area ids crime data is counted by
+        get_boundary_area_ids(boundaries_geojson, boundary_type)
+        
         if detail_level == "high":
             LONDON_BOUNDARIES_HIGH = boundaries_geojson
         elif detail_level == "low":
@@ -546,6 +587,11 @@ def load_crime_data_for_period(csv_path, boundary_type="LSOA", year=2024, month=
     if cache_key in CRIME_DATA_CACHE:
         return CRIME_DATA_CACHE[cache_key]
     
+    # Area ids come from the boundary codes, so load the boundaries (once)
+    # before counting by id
+    for detail_level in BOUNDARY_DETAIL_LEVELS.get(boundary_type, []):
+        get_cached_boundaries(detail_level)
+    
     # Handle predictions file separately
     if csv_path == FEBRUARY_2025_PREDICTIONS_CSV:
         return load_prediction_data(csv_path, boundary_type, year, month, cache_key)
@@ -571,15 +617,11 @@ def load_crime_data_for_period(csv_path, boundary_type="LSOA", year=2024, month=
             
             print(f"Using yearly file: {yearly_file} (found in {time.time() - start_time:.4f}s)")
             
-            # Determine which columns to load based on boundary type
-            if boundary_type == "LSOA":
-                boundary_columns = ['LSOA code', 'LSOA11CD', 'LSOA21CD', 'lsoa_code', 'LSOA_code', 'Lower_Super_Output_Area']
-            else:  # Ward
-                boundary_columns = ['WD24CD', 'WD24NM', 'Ward_Code', 'ward_code']
+            # The schema registry already knows which column holds the area code
+            code_column = CSV_SCHEMA_REGISTRY.get_code_column(yearly_file, boundary_type)
             
             # Load only the columns we need with optimized loading
-            # Include all possible boundary columns to ensure we get the data
-            columns_to_load = ['Month'] + boundary_columns
+            columns_to_load = ['Month'] + ([code_column] if code_column else [])
             
             print(f"Loading data for {boundary_type} level, using columns: {columns_to_load}")
             filters = {'Month': (year, month)}
@@ -588,19 +630,23 @@ def load_crime_data_for_period(csv_path, boundary_type="LSOA", year=2024, month=
             crime_data = load_burglary_data(
                 yearly_file, 
                 columns=columns_to_load, 
-                filters=filters
+                filters=filters,
+                index_manager=CSV_INDEX_MANAGER,
+                schema_registry=CSV_SCHEMA_REGISTRY,
+                area_codes=AREA_CODES
             )
             
             if len(crime_data) == 0:
                 print(f"No data found for {year}-{month} in {yearly_file}")
-                CRIME_DATA_CACHE[cache_key] = ({}, 0)
-                return {}, 0
+                CRIME_DATA_CACHE[cache_key] = (NO_COUNTS, 0)
+                return NO_COUNTS, 0
                 
             # Aggregate by area using our utility function
-            crime_counts = aggregate_by_area(crime_data, boundary_type)
-            max_value = max(crime_counts.values()) if crime_counts else 0
+            crime_counts = aggregate_by_area(crime_data, boundary_type, code_column=code_column,
+                                             area_codes=AREA_CODES)
+            max_value = crime_counts.max() if len(crime_counts) else 0
             
-            print(f"Found {len(crime_counts)} areas with data, max value: {max_value}")
+            print(f"Found {np.count_nonzero(crime_counts)} areas with data, max value: {max_value}")
             print(f"Total processing time: {time.time() - start_time:.4f}s")
             
             CRIME_DATA_CACHE[cache_key] = (crime_counts, max_value)
@@ -613,14 +659,14 @@ def load_crime_data_for_period(csv_path, boundary_type="LSOA", year=2024, month=
         print(f"Error processing crime data: {e}")
         import traceback
         traceback.print_exc()
-        CRIME_DATA_CACHE[cache_key] = ({}, 0)
-        return {}, 0
+        CRIME_DATA_CACHE[cache_key] = (NO_COUNTS, 0)
+        return NO_COUNTS, 0
 
 def load_prediction_data(csv_path, boundary_type, year, month, cache_key):
     """Handle prediction data loading and processing"""
     if not csv_path.exists():
         print(f"Prediction CSV file not found: {csv_path}")
-        return {}, 0
+        return NO_COUNTS, 0
     
     try:
         # Load prediction data
@@ -628,43 +674,38 @@ def load_prediction_data(csv_path, boundary_type, year, month, cache_key):
         
         # Ward level predictions - sum LSOA predictions by ward
         if boundary_type == "Ward" and "WD24CD" in crime_data.columns and "y_pred_lgb" in crime_data.columns:
-            ward_predictions = crime_data.groupby("WD24CD")["y_pred_lgb"].sum().reset_index()
+            ward_ids = AREA_CODES.encode("Ward", crime_data["WD24CD"].astype(str).to_numpy(), add_missing=False)
+            preds = crime_data["y_pred_lgb"].fillna(0).to_numpy()
             
-            crime_counts = {}
-            for _, row in ward_predictions.iterrows():
-                ward_code = str(row["WD24CD"])
-                ward_pred_sum = row["y_pred_lgb"]
-                crime_counts[ward_code] = round(float(ward_pred_sum), 2)
+            # Sum LSOA predictions per ward id in one pass
+            crime_counts = np.bincount(
+                ward_ids[ward_ids >= 0], weights=preds[ward_ids >= 0],
+                minlength=AREA_CODES.size("Ward")
+            ).round(2)
             
-            max_value = max(crime_counts.values()) if crime_counts else 0
+            max_value = crime_counts.max() if len(crime_counts) else 0
             
             CRIME_DATA_CACHE[cache_key] = (crime_counts, max_value)
             return crime_counts, max_value
         
         # LSOA-level predictions
         elif "y_pred_lgb" in crime_data.columns:
-            code_columns = ['LSOA code', 'LSOA11CD', 'LSOA21CD', 'lsoa_code', 'LSOA_code', 'Lower_Super_Output_Area', 'LSOA', 'LSOAC']
-            
-            crime_code_column = None
-            for col in code_columns:
-                if col in crime_data.columns:
-                    crime_code_column = col
-                    break
+            crime_code_column = CSV_SCHEMA_REGISTRY.get_code_column(csv_path, "LSOA")
             
             if not crime_code_column:
                 print(f"Warning: No LSOA code column found in prediction data")
                 print(f"Available columns: {list(crime_data.columns)}")
-                CRIME_DATA_CACHE[cache_key] = ({}, 0)
-                return {}, 0
+                CRIME_DATA_CACHE[cache_key] = (NO_COUNTS, 0)
+                return NO_COUNTS, 0
+            
+            crime_data = crime_data[crime_data['y_pred_lgb'].notna()]
+            lsoa_ids = AREA_CODES.encode("LSOA", crime_data[crime_code_column].astype(str).to_numpy(),
+                                         add_missing=False)
             
-            crime_counts = {}
-            for _, row in crime_data.iterrows():
-                area_code = str(row[crime_code_column])
-                pred_value = row['y_pred_lgb']
-                if not pd.isna(pred_value):
-                    crime_counts[area_code] = round(float(pred_value), 2)
+            crime_counts = np.zeros(AREA_CODES.size("LSOA"))
+            crime_counts[lsoa_ids[lsoa_ids >= 0]] = crime_data['y_pred_lgb'].to_numpy()[lsoa_ids >= 0].round(2)
             
-            max_value = max(crime_counts.values()) if crime_counts else 0
+            max_value = crime_counts.max() if len(crime_counts) else 0
             
             CRIME_DATA_CACHE[cache_key] = (crime_counts, max_value)
             return crime_counts, max_value
@@ -672,53 +713,53 @@ def load_prediction_data(csv_path, boundary_type, year, month, cache_key):
         # Standard prediction file format not found
         print(f"Warning: Prediction file doesn't have expected format. Missing 'y_pred_lgb' column.")
         print(f"Available columns: {list(crime_data.columns)}")
-        CRIME_DATA_CACHE[cache_key] = ({}, 0)
-        return {}, 0
+        CRIME_DATA_CACHE[cache_key] = (NO_COUNTS, 0)
+        return NO_COUNTS, 0
         
     except Exception as e:
         print(f"Error processing prediction data: {e}")
         import traceback
         traceback.print_exc()
-        CRIME_DATA_CACHE[cache_key] = ({}, 0)
-        return {}, 0
+        CRIME_DATA_CACHE[cache_key] = (NO_COUNTS, 0)
+        return NO_COUNTS, 0
 
 def load_from_original_file(csv_path, boundary_type, year, month, cache_key):
     """Original method to load crime data from the full CSV file with optimizations"""
     if not csv_path.exists():
         print(f"CSV file not found: {csv_path}")
-        return {}, 0
+        return NO_COUNTS, 0
     
     try:
         print(f"Using original file method for {year}-{month}")
         start_time = time.time()
         
-        # Determine which columns to load based on boundary type
-        if boundary_type == "LSOA":
-            boundary_columns = ['LSOA code', 'LSOA11CD', 'LSOA21CD']
-        else:  # Ward
-            boundary_columns = ['WD24CD', 'WD24NM']
+        # The schema registry already knows which column holds the area code
+        code_column = CSV_SCHEMA_REGISTRY.get_code_column(csv_path, boundary_type)
         
         # Create an optimized filter for the date
-        columns_to_load = ['Month'] + boundary_columns
+        columns_to_load = ['Month'] + ([code_column] if code_column else [])
         filters = {'Month': (year, month)}
         
         # Use our optimized CSV loading function with the full file
         crime_data = load_burglary_data(
             csv_path, 
             columns=columns_to_load, 
-            filters=filters
+            filters=filters,
+            schema_registry=CSV_SCHEMA_REGISTRY,
+            area_codes=AREA_CODES
         )
         
         if len(crime_data) == 0:
             print(f"No data found for {year}-{month} in original file")
-            CRIME_DATA_CACHE[cache_key] = ({}, 0)
-            return {}, 0
+            CRIME_DATA_CACHE[cache_key] = (NO_COUNTS, 0)
+            return NO_COUNTS, 0
             
         # Aggregate by area using our utility function
-        crime_counts = aggregate_by_area(crime_data, boundary_type)
-        max_value = max(crime_counts.values()) if crime_counts else 0
+        crime_counts = aggregate_by_area(crime_data, boundary_type, code_column=code_column,
+                                         area_codes=AREA_CODES)
+        max_value = crime_counts.max() if len(crime_counts) else 0
         
-        print(f"Found {len(crime_counts)} areas with data in original file, max value: {max_value}")
+        print(f"Found {np.count_nonzero(crime_counts)} areas with data in original file, max value: {max_value}")
         print(f"Original file processing time: {time.time() - start_time:.4f}s")
         
         CRIME_DATA_CACHE[cache_key] = (crime_counts, max_value)
@@ -728,34 +769,62 @@ def load_from_original_file(csv_path, boundary_type, year, month, cache_key):
         print(f"Error processing crime data from original file: {e}")
         import traceback
         traceback.print_exc()
-        CRIME_DATA_CACHE[cache_key] = ({}, 0)
-        return {}, 0
+        CRIME_DATA_CACHE[cache_key] = (NO_COUNTS, 0)
+        return NO_COUNTS, 0
+
+def get_boundary_code_property(boundary_geojson, boundary_type="LSOA"):
+    """Find (and remember on the GeoJSON) which property holds the area code"""
+    cache_key = f"code_property_{boundary_type}"
+    if cache_key in boundary_geojson:
+        return boundary_geojson[cache_key]
+    
+    properties = boundary_geojson['features'][0]['properties'] if boundary_geojson['features'] else {}
+    code_property = next(
+        (col for col in BOUNDARY_CODE_PROPERTIES[boundary_type] if col in properties),
+        None
+    )
+    boundary_geojson[cache_key] = code_property
+    return code_property
+
+def get_boundary_area_ids(boundary_geojson, boundary_type="LSOA"):
+    """
+    Area ids of every boundary feature, encoded once and remembered on the
+    GeoJSON; codes not seen before are added to the lookup
+    """
+    cache_key = f"area_ids_{boundary_type}"
+    if cache_key not in boundary_geojson:
+        code_property = get_boundary_code_property(boundary_geojson, boundary_type)
+        codes = [
+            feature['properties'].get(code_property) if code_property else None
+            for feature in boundary_geojson['features']
+        ]
+        boundary_geojson[cache_key] = AREA_CODES.encode(boundary_type, codes)
+    return boundary_geojson[cache_key]
 
 def combine_boundaries_with_crime_data(boundary_geojson, crime_counts, boundary_type="LSOA"):
-    """Combine pre-loaded boundaries with crime data"""
+    """Combine pre-loaded boundaries with crime data (crime counts indexed by area id)"""
     if not boundary_geojson or 'features' not in boundary_geojson:
         return boundary_geojson, []
     
-    # Determine the boundary code column
-    if boundary_type == "LSOA":
-        boundary_code_columns = ['LSOA21CD', 'LSOA11CD', 'lsoa_code']
-    else:  # Ward
-        boundary_code_columns = ['GSS_CODE', 'Ward_Code', 'NAME', 'ward_code']
+    # Gather every feature's count by area id; ids beyond the counts array
+    # (codes first seen after the counts were built) have no crimes
+    area_ids = get_boundary_area_ids(boundary_geojson, boundary_type)
+    known = (area_ids >= 0) & (area_ids < len(crime_counts))
+    feature_counts = np.zeros(len(area_ids), dtype=crime_counts.dtype)
+    feature_counts[known] = crime_counts[area_ids[known]]
+    feature_counts = feature_counts.tolist()
+    
+    # Resolve the boundary code property once per boundary set; every feature
+    # of a boundary file carries the same properties
+    code_property = get_boundary_code_property(boundary_geojson, boundary_type)
     
     # Create heatmap features (areas with crime counts > 0)
     heatmap_features = []
     updated_features = []
     
-    for feature in boundary_geojson['features']:
-        # Find the boundary code
-        boundary_code = None
-        for col in boundary_code_columns:
-            if col in feature['properties']:
-                boundary_code = feature['properties'][col]
-                break
-        
-        # Get crime count for this boundary
-        crime_count = crime_counts.get(boundary_code, 0) if boundary_code else 0
+    for feature, crime_count in zip(boundary_geojson['features'], feature_counts):
+        # The boundary code string is only needed for the response
+        boundary_code = feature['properties'].get(code_property) if code_property else None
         
         # Add crime count to feature properties
         updated_feature = {
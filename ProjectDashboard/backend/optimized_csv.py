@@ -1,6 +1,10 @@
 import pandas as pd
+import numpy as np
 import os
+import io
+import csv
 import json
+import mmap
 from pathlib import Path
 import time
 from io import StringIO
@@ -35,6 +39,89 @@ ESSENTIAL_COLUMNS = [
     'num_crimes_past_year_1km', 'MedianPrice'
 ]
 
+# Candidate names for the area code column, in order of preference
+AREA_CODE_COLUMNS = {
+    'LSOA': ['LSOA code', 'LSOA11CD', 'LSOA21CD', 'lsoa_code', 'LSOA_code',
+             'Lower_Super_Output_Area', 'LSOA', 'LSOAC'],
+    'Ward': ['WD24CD', 'WD24NM', 'Ward_Code', 'ward_code', 'Ward', 'ward',
+             'ward_name', 'Ward_Name']
+}
+
+# The aliases above that hold codes rather than names; only these are turned
+# into area ids (name columns such as WD24NM stay strings)
+AREA_ID_COLUMNS = {
+    'LSOA': ['LSOA code', 'LSOA11CD', 'LSOA21CD', 'lsoa_code', 'LSOA_code'],
+    'Ward': ['WD24CD', 'Ward_Code', 'ward_code']
+}
+
+class CSVSchemaRegistry:
+    """Records each CSV's columns, area code columns and dtypes once"""
+    
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.schema_file = self.data_dir / "csv_schemas.json"
+        self.schemas = self._load_schemas()
+    
+    def _load_schemas(self):
+        """Load existing schemas or create empty dict"""
+        if self.schema_file.exists():
+            try:
+                with open(self.schema_file, 'r') as f:
+                    return json.load(f)
+            except:
+                return {}
+        return {}
+    
+    def save_schemas(self):
+        """Save schemas to file"""
+        with open(self.schema_file, 'w') as f:
+            json.dump(self.schemas, f)
+    
+    def get_schema(self, file_path):
+        """
+        Get the schema for a CSV file, reading its header only if the file is
+        new or has changed since it was registered
+        
+        Returns:
+            Dict with 'columns', 'code_columns' ({'LSOA': col, 'Ward': col})
+            and 'dtypes' ({col: dtype name}), or None if the file is missing
+        """
+        file_path = Path(file_path)
+        if not file_path.exists():
+            return None
+        
+        file_stats = os.stat(file_path)
+        schema = self.schemas.get(file_path.name)
+        if schema and schema.get('size_bytes') == file_stats.st_size and \
+           schema.get('modified_time') == file_stats.st_mtime:
+            return schema
+        
+        print(f"Registering schema for {file_path.name}...")
+        columns = pd.read_csv(file_path, nrows=0).columns.tolist()
+        
+        code_columns = {}
+        for boundary_type, candidates in AREA_CODE_COLUMNS.items():
+            code_columns[boundary_type] = next((c for c in candidates if c in columns), None)
+        
+        schema = {
+            'size_bytes': file_stats.st_size,
+            'modified_time': file_stats.st_mtime,
+            'columns': columns,
+            'code_columns': code_columns,
+            'dtypes': {
+                col: pd.api.types.pandas_dtype(COLUMN_DTYPES.get(col, object)).name
+                for col in columns if col != 'Month'
+            }
+        }
+        self.schemas[file_path.name] = schema
+        self.save_schemas()
+        return schema
+    
+    def get_code_column(self, file_path, boundary_type):
+        """Get the canonical LSOA or Ward code column of a CSV file"""
+        schema = self.get_schema(file_path)
+        return schema['code_columns'].get(boundary_type) if schema else None
+
 class CSVIndexManager:
     """Manages indices for faster CSV lookups"""
     
@@ -69,8 +156,8 @@ class CSVIndexManager:
         for csv_file in csv_files:
             file_name = csv_file.name
             
-            # Skip if index exists and rebuild not requested
-            if file_name in self.indices and not rebuild:
+            # Skip if index exists (with month offsets) and rebuild not requested
+            if 'month_offsets' in self.indices.get(file_name, {}) and not rebuild:
                 continue
                 
             print(f"Building index for {file_name}...")
@@ -80,32 +167,28 @@ class CSVIndexManager:
             file_stats = os.stat(csv_file)
             
             try:
-                # Try to read the first 100 rows to get a sample of dates
-                df_sample = pd.read_csv(csv_file, nrows=100)
+                # One pass over the raw bytes gives both the month list and
+                # the byte range of every month, so readers can seek straight to it
+                header_end, month_offsets = scan_month_offsets(csv_file)
                 
-                # Make sure Month column exists
-                if 'Month' not in df_sample.columns:
-                    print(f"Warning: No Month column in {file_name}, available columns: {df_sample.columns.tolist()}")
+                if month_offsets is None:
+                    print(f"Warning: No Month column in {file_name}")
                     continue
                 
-                # Parse Month column
-                df_sample['Month'] = pd.to_datetime(df_sample['Month'], errors='coerce')
-                
-                # Read the whole file just for Month column to get unique values
-                all_months = pd.read_csv(csv_file, usecols=['Month'])['Month'].unique()
-                all_months_parsed = pd.to_datetime(all_months, errors='coerce')
-                
-                # Get min/max dates after parsing
-                min_date = pd.to_datetime(all_months, errors='coerce').min()
-                max_date = pd.to_datetime(all_months, errors='coerce').max()
+                months = sorted(month_offsets)
+                if not months:
+                    print(f"Warning: No valid months found in {file_name}")
+                    continue
                 
                 # Create and store the index
                 self.indices[file_name] = {
                     'size_bytes': file_stats.st_size,
                     'modified_time': file_stats.st_mtime,
-                    'first_month': min_date.strftime('%Y-%m'),
-                    'last_month': max_date.strftime('%Y-%m'),
-                    'months': sorted([d.strftime('%Y-%m') for d in all_months_parsed if pd.notna(d)])
+                    'first_month': months[0],
+                    'last_month': months[-1],
+                    'months': months,
+                    'header_end': header_end,
+                    'month_offsets': month_offsets
                 }
                 
             except Exception as e:
@@ -143,8 +226,155 @@ class CSVIndexManager:
         
         # If no specific file found, return None
         return None
+    
+    def get_month_ranges(self, file_path, year, month):
+        """
+        Get the byte ranges holding a given year/month in an indexed file
+        
+        Returns:
+            (header_end, [[start, end], ...]) or None if the file is not indexed,
+            has changed since it was indexed, or was indexed without offsets
+        """
+        file_path = Path(file_path)
+        index = self.indices.get(file_path.name)
+        if not index or 'month_offsets' not in index or not file_path.exists():
+            return None
+        
+        # A stale index would point into the wrong rows, so only trust it
+        # while the file is byte-for-byte the size it was when indexed
+        file_stats = os.stat(file_path)
+        if file_stats.st_size != index.get('size_bytes') or \
+           file_stats.st_mtime != index.get('modified_time'):
+            print(f"Index for {file_path.name} is stale, ignoring month offsets")
+            return None
+        
+        target_month = f"{year}-{month:02d}"
+        return index['header_end'], index['month_offsets'].get(target_month, [])
 
-def load_burglary_data(file_path, columns=None, filters=None):
+def _month_field(line, month_idx):
+    """Extract the YYYY-MM value of the Month field from a raw CSV line"""
+    # Fast path: no quoting before the Month field, so a plain split is exact
+    head = line.split(b',', month_idx + 1)
+    if len(head) > month_idx and b'"' not in b','.join(head[:month_idx + 1]):
+        value = head[month_idx]
+    else:
+        fields = next(csv.reader([line.decode('utf-8', errors='replace')]), [])
+        if len(fields) <= month_idx:
+            return None
+        value = fields[month_idx].encode()
+    
+    value = value.strip().strip(b'"')[:7]
+    # Guard against stray repeated headers or malformed values
+    if len(value) != 7 or value[4:5] != b'-' or not value[:4].isdigit():
+        return None
+    return value.decode()
+
+def scan_month_offsets(csv_file):
+    """
+    Scan a CSV once and record the byte ranges occupied by each month
+    
+    Consecutive rows of the same month are merged into a single range, so a
+    file sorted by month has exactly one range per month.
+    
+    Returns:
+        (header_end, {'YYYY-MM': [[start, end], ...]}), or (header_end, None)
+        if the file has no Month column
+    """
+    month_offsets = {}
+    
+    with open(csv_file, 'rb') as f:
+        header = f.readline()
+        header_end = f.tell()
+        columns = next(csv.reader([header.decode('utf-8-sig').strip()]), [])
+        if 'Month' not in columns:
+            return header_end, None
+        month_idx = columns.index('Month')
+        
+        current_month, run_start = None, header_end
+        pos = header_end
+        for line in f:
+            month_value = _month_field(line, month_idx)
+            if month_value != current_month:
+                if current_month is not None:
+                    month_offsets.setdefault(current_month, []).append([run_start, pos])
+                current_month, run_start = month_value, pos
+            pos += len(line)
+        
+        if current_month is not None:
+            month_offsets.setdefault(current_month, []).append([run_start, pos])
+    
+    # Rows that had no parseable month are not addressable by any month
+    month_offsets.pop(None, None)
+    return header_end, month_offsets
+
+class _MappedRange(io.RawIOBase):
+    """Read-only file object over a slice of a memory map (no copy of the slice)"""
+    
+    def __init__(self, mm, start, end):
+        self._view = memoryview(mm)[start:end]
+        self._pos = 0
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        n = min(len(buffer), len(self._view) - self._pos)
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+    
+    def close(self):
+        self._view.release()
+        super().close()
+
+def read_month_rows(file_path, header_end, ranges, columns, dtypes):
+    """
+    Parse only the rows inside the given byte ranges of a memory-mapped CSV
+    
+    Args:
+        file_path: Path to the CSV file
+        header_end: Byte offset where the header line ends
+        ranges: List of [start, end] byte ranges to parse
+        columns: Columns to load (must exist in the header)
+        dtypes: Dtype map for the loaded columns
+        
+    Returns:
+        Pandas DataFrame with the rows of those ranges only
+    """
+    with open(file_path, 'rb') as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header = mm[:header_end].decode('utf-8-sig').strip()
+        names = next(csv.reader([header]), [])
+        
+        frames = []
+        for start, end in ranges:
+            with io.BufferedReader(_MappedRange(mm, start, end)) as chunk:
+                frames.append(pd.read_csv(
+                    chunk,
+                    header=None,
+                    names=names,
+                    usecols=columns,
+                    dtype=dtypes,
+                    low_memory=False
+                ))
+    
+    if not frames:
+        return pd.DataFrame({col: pd.Series(dtype=dtypes.get(col, object)) for col in columns})
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def encode_area_columns(df, area_codes):
+    """
+    Replace LSOA/Ward code columns in df with int32 ids from the area code
+    dictionary (read-only: unknown codes become MISSING_ID)
+    """
+    for boundary_type, candidates in AREA_ID_COLUMNS.items():
+        for col in candidates:
+            if col in df.columns and not pd.api.types.is_integer_dtype(df[col]):
+                df[col] = area_codes.encode(boundary_type, df[col].to_numpy(), add_missing=False)
+    return df
+
+def load_burglary_data(file_path, columns=None, filters=None, index_manager=None,
+                       schema_registry=None, area_codes=None):
     """
     Efficiently load burglary data with optimizations
     
@@ -152,6 +382,13 @@ def load_burglary_data(file_path, columns=None, filters=None):
         file_path: Path to the CSV file
         columns: List of columns to load (defaults to essential columns)
         filters: Dict of column-value pairs to filter by
+        index_manager: Optional CSVIndexManager; when the file has month offsets
+            a Month filter reads only that month's byte range
+        schema_registry: Optional CSVSchemaRegistry; when given, the registered
+            columns and dtypes are used instead of re-reading the header
+        area_codes: Optional AreaCodeDictionary; when given, LSOA/Ward code
+            columns (AREA_ID_COLUMNS, not name columns) are returned as int32
+            ids instead of strings, MISSING_ID for codes it doesn't know
         
     Returns:
         Pandas DataFrame with requested data
@@ -163,11 +400,16 @@ def load_burglary_data(file_path, columns=None, filters=None):
     # Use provided columns or default to essential ones
     columns_to_load = columns or ESSENTIAL_COLUMNS
     
+    schema = schema_registry.get_schema(file_path) if schema_registry is not None else None
+    
     # First, check what columns actually exist in the file
-    # Read just the header to get column names
+    # Read just the header to get column names, unless the schema is registered
     try:
-        header_df = pd.read_csv(file_path, nrows=0)
-        available_cols = header_df.columns.tolist()
+        if schema is not None:
+            available_cols = schema['columns']
+        else:
+            header_df = pd.read_csv(file_path, nrows=0)
+            available_cols = header_df.columns.tolist()
         
         # Filter to only columns that exist
         valid_columns = [col for col in columns_to_load if col in available_cols]
@@ -182,13 +424,39 @@ def load_burglary_data(file_path, columns=None, filters=None):
         valid_columns = columns_to_load
     
     # Create a dict of only the datatypes we need
-    dtypes = {col: COLUMN_DTYPES.get(col, object) for col in valid_columns if col != 'Month'}
+    if schema is not None:
+        dtypes = {col: schema['dtypes'][col] for col in valid_columns if col in schema['dtypes']}
+    else:
+        dtypes = {col: COLUMN_DTYPES.get(col, object) for col in valid_columns if col != 'Month'}
     
     # Determine if we need to parse dates
     parse_dates = ['Month'] if 'Month' in valid_columns else None
     
     print(f"Loading columns: {valid_columns} from {file_path}")
     
+    # Seek directly to the requested month if the index knows where it is
+    month_filter = (filters or {}).get('Month')
+    month_ranges = None
+    if index_manager is not None and isinstance(month_filter, tuple) and len(month_filter) == 2:
+        month_ranges = index_manager.get_month_ranges(file_path, *month_filter)
+    
+    if month_ranges is not None:
+        header_end, ranges = month_ranges
+        print(f"Reading {len(ranges)} byte range(s) for {month_filter[0]}-{month_filter[1]:02d}")
+        df = read_month_rows(file_path, header_end, ranges, valid_columns, dtypes)
+        if 'Month' in df.columns:
+            df['Month'] = pd.to_datetime(df['Month'], errors='coerce')
+        
+        # The byte ranges already hold exactly this month
+        filters = {k: v for k, v in filters.items() if k != 'Month'}
+        for column, value in filters.items():
+            if column in df.columns:
+                print(f"Filtering {column} == {value}")
+                df = df[df[column] == value]
+        
+        print(f"After filtering: {len(df)} rows")
+        return encode_area_columns(df, area_codes) if area_codes is not None else df
+    
     # Only read the needed columns with correct types
     try:
         df = pd.read_csv(
@@ -230,35 +498,56 @@ def load_burglary_data(file_path, columns=None, filters=None):
                     print(f"Error filtering on {column}: {e}")
     
     print(f"After filtering: {len(df)} rows")
-    return df
+    return encode_area_columns(df, area_codes) if area_codes is not None else df
 
-def aggregate_by_area(df, boundary_type="LSOA"):
+def aggregate_by_area(df, boundary_type="LSOA", code_column=None, area_codes=None):
     """
     Aggregate crime data by area (LSOA or Ward)
     
     Args:
         df: DataFrame containing crime data
         boundary_type: "LSOA" or "Ward"
+        code_column: Column to group by, if already known (e.g. from the
+            schema registry); otherwise the first available alias is used
+        area_codes: Optional AreaCodeDictionary the code columns were encoded
+            with; rows with MISSING_ID (codes it doesn't know) are not counted
         
     Returns:
-        Dict mapping area codes to crime counts
+        Dict mapping area codes to crime counts, or - when area_codes is
+        given - an array of crime counts indexed by area id
     """
     # Determine column to use for grouping
-    if boundary_type == "LSOA":
-        code_columns = ['LSOA code', 'LSOA11CD', 'LSOA21CD', 'lsoa_code', 'LSOA_code', 'Lower_Super_Output_Area']
-    else:  # Ward
-        code_columns = ['WD24CD', 'WD24NM', 'Ward_Code', 'ward_code', 'Ward', 'ward', 'ward_name', 'Ward_Name']
-    
-    # Find the first available column
-    code_column = None
-    for col in code_columns:
-        if col in df.columns:
-            code_column = col
-            break
+    if code_column is None or code_column not in df.columns:
+        code_column = next(
+            (col for col in AREA_CODE_COLUMNS.get(boundary_type, AREA_CODE_COLUMNS['Ward'])
+             if col in df.columns),
+            None
+        )
+    
+    if area_codes is not None and code_column and not pd.api.types.is_integer_dtype(df[code_column]):
+        # Only code columns are encoded; group by one of those rather than a name column
+        code_column = next(
+            (col for col in AREA_ID_COLUMNS.get(boundary_type, AREA_ID_COLUMNS['Ward'])
+             if col in df.columns and pd.api.types.is_integer_dtype(df[col])),
+            code_column
+        )
     
     if not code_column:
         print(f"Warning: No {boundary_type} code column found in {df.columns.tolist()}")
-        return {}
+        return np.zeros(area_codes.size(boundary_type), dtype=np.int64) if area_codes is not None else {}
+    
+    if area_codes is not None:
+        if pd.api.types.is_integer_dtype(df[code_column]):
+            ids = df[code_column].to_numpy()
+        elif code_column in AREA_ID_COLUMNS.get(boundary_type, AREA_ID_COLUMNS['Ward']):
+            ids = area_codes.encode(boundary_type, df[code_column].to_numpy(), add_missing=False)
+        else:
+            print(f"Warning: {code_column} holds {boundary_type} names, not codes; no areas counted")
+            return np.zeros(area_codes.size(boundary_type), dtype=np.int64)
+        # Ids are dense, so counting is a single bincount
+        crime_counts = np.bincount(ids[ids >= 0], minlength=area_codes.size(boundary_type))
+        print(f"Aggregated {len(df)} records by {code_column}, found {np.count_nonzero(crime_counts)} areas")
+        return crime_counts
     
     # Aggregate and convert to dict
     crime_counts = df[code_column].value_counts().to_dict()
@@ -0,0 +1,226 @@
+"""
+area_assign.py
+
+Fast point-in-polygon assignment of incidents to wards / LSOAs.
+
+A PolygonIndex prepares a boundary shapefile once into
+  - an STRtree over the (prepared) polygons, and
+  - a rasterized lookup grid: every cell that lies strictly inside a single
+    polygon stores that polygon, cells touching no polygon store NO_POLYGON
+    and the rest are marked BOUNDARY.
+
+Points are assigned by a grid lookup; only points in boundary cells go
+through an exact STRtree "within" query, so results match
+gpd.sjoin(..., predicate="within") while most points never touch a polygon.
+The grid, polygons (as WKB) and attribute table (as Parquet) are cached in
+data/spatial_index and reused until the shapefile changes, so monthly runs
+skip the preparation entirely. The cache file is named after the shapefile
+plus a short hash of the columns, bbox and grid size, so indexes over the
+same shapefile with different options keep separate caches. Points can be
+assigned chunk by chunk, so memory stays bounded by the chunk size.
+"""
+
+import hashlib
+import json
+import os
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / "data" / "spatial_index"
+
+# Lookup grid resolution in degrees (~35 m x 55 m around London)
+CELL_DEG = 0.0005
+
+# Grid rows classified per batch while building
+BUILD_ROWS = 64
+
+NO_POLYGON = -1
+BOUNDARY = -2
+
+# Ward shapefile fields and the names the pipeline uses for them
+WARD_COLUMNS = {
+    'NAME':      'WD24NM',
+    'GSS_CODE':  'WD24CD',
+    'DISTRICT':  'LAD24NM'
+}
+
+# Approx. London bounding box in degrees (lon_min, lat_min, lon_max, lat_max)
+LONDON_BBOX = (-0.5103, 51.2868, 0.3340, 51.6919)
+
+
+def _source_signature(shp_path):
+    """Size and mtime of the shapefile's component files"""
+    shp_path = Path(shp_path)
+    signature = {}
+    for suffix in ('.shp', '.shx', '.dbf', '.prj'):
+        part = shp_path.with_suffix(suffix)
+        if part.exists():
+            stats = os.stat(part)
+            signature[suffix] = [stats.st_size, stats.st_mtime]
+    return signature
+
+
+class PolygonIndex:
+    """Grid + STRtree point-in-polygon index over one boundary shapefile"""
+
+    def __init__(self, shp_path, columns=None, bbox=None, cell_deg=CELL_DEG,
+                 cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Args:
+            shp_path: Boundary shapefile (any CRS, used in EPSG:4326)
+            columns: Attribute columns to attach (default: all)
+            bbox: Optional (lon_min, lat_min, lon_max, lat_max); polygons
+                not intersecting it are dropped (e.g. LSOAs outside London)
+            cell_deg: Lookup grid resolution in degrees
+            cache_dir: Directory for the prepared index
+        """
+        self.shp_path = Path(shp_path)
+        self.cell_deg = cell_deg
+        key = {
+            'source': _source_signature(self.shp_path),
+            'columns': list(columns) if columns is not None else None,
+            'bbox': list(bbox) if bbox is not None else None,
+            'cell_deg': cell_deg
+        }
+        options = json.dumps({k: v for k, v in key.items() if k != 'source'}, sort_keys=True)
+        options_hash = hashlib.sha1(options.encode()).hexdigest()[:10]
+        self.cache_file = Path(cache_dir) / f"{self.shp_path.stem}_{options_hash}.npz"
+
+        if not self._load_cache(key):
+            self._build(columns, bbox)
+            self._save_cache(key)
+
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+        # Attribute rows plus an all-missing row for NO_POLYGON
+        self._attribute_rows = self.attributes.reindex(np.arange(len(self.attributes) + 1))
+
+    def _build(self, columns, bbox):
+        """Read the shapefile and classify every grid cell"""
+        print(f"Building polygon index for {self.shp_path}...")
+        polygons = gpd.read_file(self.shp_path).to_crs("EPSG:4326")
+        if bbox is not None:
+            polygons = polygons[polygons.intersects(shapely.box(*bbox))]
+        polygons = polygons.reset_index(drop=True)
+
+        attribute_columns = [col for col in polygons.columns if col != polygons.geometry.name]
+        if columns is not None:
+            attribute_columns = [col for col in attribute_columns if col in columns]
+        self.attributes = pd.DataFrame(polygons[attribute_columns])
+        self.geoms = polygons.geometry.to_numpy()
+
+        # One spare row/column so points on the far edges still fall inside the grid
+        minx, miny, maxx, maxy = polygons.total_bounds
+        self.origin = (float(minx), float(miny))
+        nx = int(np.floor((maxx - minx) / self.cell_deg)) + 2
+        ny = int(np.floor((maxy - miny) / self.cell_deg)) + 2
+        self.grid = np.full((ny, nx), NO_POLYGON, dtype=np.int32)
+
+        shapely.prepare(self.geoms)
+        tree = shapely.STRtree(self.geoms)
+        xs = minx + np.arange(nx) * self.cell_deg
+        for r0 in range(0, ny, BUILD_ROWS):
+            rows = np.arange(r0, min(r0 + BUILD_ROWS, ny))
+            x0 = np.tile(xs, len(rows))
+            y0 = np.repeat(miny + rows * self.cell_deg, nx)
+            boxes = shapely.box(x0, y0, x0 + self.cell_deg, y0 + self.cell_deg)
+
+            cell_idx, poly_idx = tree.query(boxes, predicate='intersects')
+            hits = np.bincount(cell_idx, minlength=len(boxes))
+            block = np.where(hits > 0, BOUNDARY, NO_POLYGON).astype(np.int32)
+
+            # A cell touched by a single polygon that holds it strictly inside
+            # (boundary included) resolves every point in it
+            single = hits[cell_idx] == 1
+            cell_idx, poly_idx = cell_idx[single], poly_idx[single]
+            inside = shapely.contains_properly(self.geoms[poly_idx], boxes[cell_idx])
+            block[cell_idx[inside]] = poly_idx[inside]
+            self.grid[rows] = block.reshape(len(rows), nx)
+
+        boundary = (self.grid == BOUNDARY).mean()
+        print(f"Indexed {len(self.geoms):,} polygons on a {ny} x {nx} grid ({boundary:.1%} boundary cells)")
+
+    def _load_cache(self, key):
+        """Load the prepared index if it was built from the same inputs"""
+        if not self.cache_file.exists():
+            return False
+        try:
+            with np.load(self.cache_file) as cached:
+                if json.loads(str(cached['key'])) != json.loads(json.dumps(key)):
+                    return False
+                self.grid = cached['grid']
+                self.origin = tuple(cached['origin'])
+                wkb, offsets = cached['wkb'].tobytes(), cached['wkb_offsets']
+                self.geoms = shapely.from_wkb([wkb[a:b] for a, b in zip(offsets[:-1], offsets[1:])])
+                self.attributes = pd.read_parquet(BytesIO(cached['attributes'].tobytes()))
+            return True
+        except Exception as e:
+            print(f"Could not load polygon index cache {self.cache_file}: {e}")
+            return False
+
+    def _save_cache(self, key):
+        """Persist grid, polygons and attributes"""
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        wkb = shapely.to_wkb(self.geoms)
+        offsets = np.concatenate([[0], np.cumsum([len(w) for w in wkb])])
+        # Parquet keeps the attribute dtypes and float values exactly (JSON
+        # rounds floats), so cached runs match sjoin like the first one
+        attributes = BytesIO()
+        self.attributes.to_parquet(attributes, index=False)
+        np.savez(
+            self.cache_file,
+            key=np.array(json.dumps(key)),
+            grid=self.grid,
+            origin=np.array(self.origin),
+            wkb=np.frombuffer(b''.join(wkb), dtype=np.uint8),
+            wkb_offsets=offsets,
+            attributes=np.frombuffer(attributes.getvalue(), dtype=np.uint8)
+        )
+
+    def lookup(self, lons, lats):
+        """
+        Polygon position (row of self.attributes) containing each point,
+        NO_POLYGON where none does
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        ny, nx = self.grid.shape
+        with np.errstate(invalid='ignore'):
+            col = np.floor((lons - self.origin[0]) / self.cell_deg)
+            row = np.floor((lats - self.origin[1]) / self.cell_deg)
+            in_grid = (col >= 0) & (col < nx) & (row >= 0) & (row < ny)
+
+        result = np.full(len(lons), NO_POLYGON, dtype=np.int32)
+        result[in_grid] = self.grid[row[in_grid].astype(np.int64), col[in_grid].astype(np.int64)]
+
+        # Exact test for points in boundary cells
+        exact = np.flatnonzero(result == BOUNDARY)
+        result[exact] = NO_POLYGON
+        if len(exact):
+            point_idx, poly_idx = self.tree.query(
+                shapely.points(lons[exact], lats[exact]), predicate='within'
+            )
+            # Overlapping polygons: keep the first, like a deduplicated sjoin
+            first = np.full(len(exact), np.iinfo(np.int32).max, dtype=np.int64)
+            np.minimum.at(first, point_idx, poly_idx)
+            found = first < np.iinfo(np.int32).max
+            result[exact[found]] = first[found]
+        return result
+
+    def assign(self, df, lon_col='longitude', lat_col='latitude', rename=None):
+        """
+        Attach the containing polygon's attributes to each row of df (NaN
+        where no polygon contains the point), like a left sjoin
+        """
+        idx = self.lookup(df[lon_col].to_numpy(), df[lat_col].to_numpy())
+        rows = np.where(idx >= 0, idx, len(self.attributes))
+        attrs = self._attribute_rows.iloc[rows].set_axis(df.index)
+        if rename:
+            attrs = attrs.rename(columns=rename)
+        out = df.drop(columns=[col for col in attrs.columns if col in df.columns])
+        return pd.concat([out, attrs], axis=1)
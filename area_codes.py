@@ -0,0 +1,189 @@
+"""
+area_codes.py
+
+Shared dictionary mapping LSOA codes (LSOA21CD) and ward codes (WD24CD /
+GSS_CODE) to dense int32 ids.
+
+DataFrames, caches and joins across the pipeline carry these ids instead of
+Python strings; codes are only turned back into strings where they leave the
+pipeline (CSV outputs, API responses). Ids are stable: new codes are appended
+and the dictionary is persisted to data/area_codes.json as soon as it grows.
+
+Several processes may grow the same file (e.g. a full feature build and an
+--update). Growing holds a lock file (data/area_codes.json.lock) across
+processes and re-reads the file under it before assigning ids, so codes
+another process added first keep that process's ids; the file is replaced
+atomically, so readers never see a partial file.
+
+With codes_file=None the dictionary lives in memory only (the map API builds
+its own from the boundary codes it serves).
+"""
+
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+DEFAULT_CODES_FILE = Path(__file__).resolve().parent / "data" / "area_codes.json"
+
+# Id used for missing / unknown codes
+MISSING_ID = -1
+
+# Serialises growing the code lists within a process (re-entrant: encode
+# saves while holding it); the lock file serialises processes
+_LOCK = threading.RLock()
+
+
+@contextmanager
+def _file_lock(lock_path):
+    """Exclusive lock on lock_path, shared by every process, for the with block"""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as f:
+        if os.name == "nt":
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 s; keep waiting
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class AreaCodeDictionary:
+    """Dense int32 ids for LSOA and ward codes"""
+
+    KINDS = ("LSOA", "Ward")
+
+    def __init__(self, codes_file=DEFAULT_CODES_FILE):
+        self.codes_file = Path(codes_file) if codes_file is not None else None
+        self._codes = self._load_codes()
+
+    def _load_codes(self):
+        """Load existing code lists or start empty ones"""
+        stored = {}
+        if self.codes_file is not None and self.codes_file.exists():
+            try:
+                with open(self.codes_file, "r") as f:
+                    stored = json.load(f)
+            except Exception:
+                stored = {}
+        return {kind: pd.Index(stored.get(kind, []), dtype=object) for kind in self.KINDS}
+
+    @contextmanager
+    def _growing(self):
+        """
+        Hold the thread and file locks, with the code lists brought up to
+        date with the file (codes other processes appended since we read it)
+        """
+        with _LOCK:
+            if self.codes_file is None:
+                yield
+                return
+            with _file_lock(self.codes_file.with_name(self.codes_file.name + ".lock")):
+                stored = self._load_codes()
+                for kind in self.KINDS:
+                    ours, theirs = self._codes[kind], stored[kind]
+                    if theirs[:len(ours)].equals(ours):
+                        self._codes[kind] = theirs
+                    elif not ours[:len(theirs)].equals(theirs):
+                        raise ValueError(
+                            f"{self.codes_file} has different {kind} ids than this dictionary handed out; "
+                            "it was rewritten by another process"
+                        )
+                yield
+
+    def _write(self):
+        """Write the code lists (a temp file in the same directory, then os.replace)"""
+        self.codes_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.codes_file.parent, prefix=self.codes_file.name, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({kind: codes.tolist() for kind, codes in self._codes.items()}, f)
+            os.replace(tmp_path, self.codes_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def save(self):
+        """Save code lists to file, merged with codes other processes added"""
+        if self.codes_file is None:
+            return
+        with self._growing():
+            self._write()
+
+    def size(self, kind):
+        """Number of known codes of a kind (ids run from 0 to size - 1)"""
+        return len(self._codes[kind])
+
+    def encode(self, kind, values, add_missing=True):
+        """
+        Map codes to int32 ids
+
+        Args:
+            kind: "LSOA" or "Ward"
+            values: Iterable of code strings (NaN / None allowed)
+            add_missing: Assign new ids to unseen codes (and persist them);
+                otherwise unseen codes map to MISSING_ID
+
+        Returns:
+            int32 NumPy array of ids, MISSING_ID where the code is missing
+        """
+        # Factorize first so each distinct code is hashed against the
+        # dictionary only once, however many rows repeat it
+        labels, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        uniques = pd.Index(uniques, dtype=object)
+
+        unique_ids = self._codes[kind].get_indexer(uniques)
+
+        if add_missing and (unique_ids < 0).any():
+            with self._growing():
+                # Look up again under the locks: another thread or process
+                # may have added them
+                codes = self._codes[kind]
+                unique_ids = codes.get_indexer(uniques)
+                unseen = unique_ids < 0
+                if unseen.any():
+                    new_codes = uniques[unseen]
+                    self._codes[kind] = codes.append(new_codes)
+                    unique_ids[unseen] = np.arange(len(codes), len(codes) + len(new_codes))
+                    if self.codes_file is not None:
+                        self._write()
+
+        unique_ids = np.append(unique_ids, MISSING_ID).astype(np.int32)
+        # labels == -1 (missing value) picks the trailing MISSING_ID
+        return unique_ids[labels]
+
+    def decode(self, kind, ids):
+        """
+        Map int ids back to code strings
+
+        Returns:
+            Object NumPy array of codes, None where the id is MISSING_ID
+        """
+        ids = np.asarray(ids)
+        codes = np.append(self._codes[kind].to_numpy(dtype=object), None)
+        return codes[np.where(ids >= 0, ids, len(codes) - 1)]
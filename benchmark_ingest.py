@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+benchmark_ingest.py
+
+Throughput benchmark for the ingestion pipeline on synthetic data.
+
+generate: writes a police.uk street-level style CSV of any size (1M-20M
+rows and beyond), month by month so memory stays bounded. Incidents sit on
+a fixed set of snap points clustered around LSOA centres (denser towards
+central London), with police.uk's columns, crime types and outcomes, and
+a fraction of malformed rows of the kinds the cleaners deal with:
+  - stray header rows in the middle of the file
+  - missing or non-numeric coordinates
+  - coordinates outside London
+  - whitespace-padded / lower-case values
+  - exact duplicate rows
+A <csv>.json sidecar records the settings and the number of rows.
+
+run: times every ingestion stage on such a file, each in a fresh process
+so its peak memory is its own:
+  1. clean           stream_clean.py (raw export -> cleaned yearly files)
+  2. ward_join       area_assign.PolygonIndex, as crimes_to_wards.py
+                     (includes building the polygon index)
+  3. rolling_counts  spatial_counts, as add_crimes_in_range.py
+  4. split_index     split_burglaries_by_year.py (yearly files + index)
+and appends rows, seconds, rows/sec and peak memory per stage to
+outputs/benchmarks/ingest_benchmarks.csv, so runs before and after a change
+can be compared.
+
+Usage:
+    python benchmark_ingest.py generate --rows 1000000 --out data/benchmark/police_1M.csv
+    python benchmark_ingest.py run data/benchmark/police_1M.csv [--workers 4]
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from area_assign import PolygonIndex, WARD_COLUMNS
+from ProjectDashboard.backend.optimized_csv import CSVIndexManager
+from spatial_counts import rolling_neighbour_features
+from split_burglaries_by_year import main as split_by_year
+from stream_clean import stream_clean
+
+WARD_SHP = Path("London-wards-2018-ESRI/London_Ward.shp")
+WORK_DIR = Path("outputs/benchmarks/work")
+RESULTS_CSV = Path("outputs/benchmarks/ingest_benchmarks.csv")
+
+CHUNK_SIZE = 500_000
+
+# Generator defaults
+START_MONTH = "2011-01"
+END_MONTH = "2025-03"
+BURGLARY_SHARE = 0.5     # the rest are other crime types for the filter to drop
+MALFORMED_SHARE = 0.001
+N_LSOAS = 4994           # London LSOAs (2021)
+POINTS_PER_LSOA = 10     # snap points per LSOA
+
+COLUMNS = ['Crime ID', 'Month', 'Reported by', 'Falls within', 'Longitude', 'Latitude',
+           'Location', 'LSOA code', 'LSOA name', 'Crime type', 'Last outcome category', 'Context']
+
+# Approx. London bounding box in degrees (same as map_to_graph.py)
+LONDON_BBOX = {'lon': (-0.5103, 0.3340), 'lat': (51.2868, 51.6919)}
+CENTRAL_LONDON = (-0.1180, 51.5090)
+
+BOROUGHS = [
+    'Barking and Dagenham', 'Barnet', 'Bexley', 'Brent', 'Bromley', 'Camden', 'City of London',
+    'Croydon', 'Ealing', 'Enfield', 'Greenwich', 'Hackney', 'Hammersmith and Fulham', 'Haringey',
+    'Harrow', 'Havering', 'Hillingdon', 'Hounslow', 'Islington', 'Kensington and Chelsea',
+    'Kingston upon Thames', 'Lambeth', 'Lewisham', 'Merton', 'Newham', 'Redbridge',
+    'Richmond upon Thames', 'Southwark', 'Sutton', 'Tower Hamlets', 'Waltham Forest',
+    'Wandsworth', 'Westminster'
+]
+STREET_SUFFIXES = ['Road', 'Street', 'Avenue', 'Close', 'Lane', 'Gardens', 'Way', 'Place']
+
+# Other crime types and their weights relative to each other
+OTHER_CRIME_TYPES = {
+    'Anti-social behaviour': 0.30, 'Violence and sexual offences': 0.22, 'Vehicle crime': 0.10,
+    'Other theft': 0.10, 'Theft from the person': 0.05, 'Criminal damage and arson': 0.06,
+    'Shoplifting': 0.05, 'Public order': 0.05, 'Drugs': 0.03, 'Robbery': 0.02,
+    'Bicycle theft': 0.01, 'Possession of weapons': 0.01
+}
+OUTCOMES = {
+    'Investigation complete; no suspect identified': 0.55, 'Under investigation': 0.15,
+    'Unable to prosecute suspect': 0.15, 'Status update unavailable': 0.08,
+    'Awaiting court outcome': 0.04, 'Offender given a caution': 0.03
+}
+MALFORMED_KINDS = ['stray_header', 'bad_coordinates', 'outside_london', 'padded', 'duplicate']
+
+
+def _normalised(weights):
+    values = np.array(list(weights.values()), dtype=float)
+    return list(weights), values / values.sum()
+
+
+def synthetic_locations(rng):
+    """Snap points with their street name, LSOA code / name and popularity"""
+    # LSOA centres: dense around central London, thinning out to the edges
+    n_central = N_LSOAS * 2 // 3
+    lon = np.concatenate([
+        rng.normal(CENTRAL_LONDON[0], 0.12, n_central),
+        rng.uniform(*LONDON_BBOX['lon'], N_LSOAS - n_central)
+    ])
+    lat = np.concatenate([
+        rng.normal(CENTRAL_LONDON[1], 0.07, n_central),
+        rng.uniform(*LONDON_BBOX['lat'], N_LSOAS - n_central)
+    ])
+    lon = np.clip(lon, LONDON_BBOX['lon'][0] + 0.02, LONDON_BBOX['lon'][1] - 0.02)
+    lat = np.clip(lat, LONDON_BBOX['lat'][0] + 0.02, LONDON_BBOX['lat'][1] - 0.02)
+
+    # Each LSOA takes the name of the nearest of a set of borough centres
+    borough_lon = rng.uniform(*LONDON_BBOX['lon'], len(BOROUGHS))
+    borough_lat = rng.uniform(*LONDON_BBOX['lat'], len(BOROUGHS))
+    borough = np.argmin((lon[:, None] - borough_lon) ** 2 + (lat[:, None] - borough_lat) ** 2, axis=1)
+    lsoa_number = pd.Series(borough).groupby(borough).cumcount().to_numpy()
+    lsoa_names = [f"{BOROUGHS[b]} {k // 4 + 1:03d}{'ABCD'[k % 4]}" for b, k in zip(borough, lsoa_number)]
+
+    lsoa = np.repeat(np.arange(N_LSOAS), POINTS_PER_LSOA)
+    n_points = len(lsoa)
+    streets = rng.integers(0, 5000, n_points)
+    return pd.DataFrame({
+        'Longitude': (lon[lsoa] + rng.normal(0, 0.003, n_points)).round(6).astype(str),
+        'Latitude': (lat[lsoa] + rng.normal(0, 0.002, n_points)).round(6).astype(str),
+        'Location': [f"On or near Street {s} {STREET_SUFFIXES[s % len(STREET_SUFFIXES)]}" for s in streets],
+        'LSOA code': [f"E0{1000000 + i:07d}" for i in lsoa],
+        'LSOA name': np.array(lsoa_names)[lsoa],
+        'weight': rng.lognormal(0, 1, n_points)
+    })
+
+
+def crime_ids(rng, n):
+    """police.uk style 64-character hex crime ids"""
+    return np.frombuffer(rng.bytes(32 * n).hex().encode(), dtype='S64').astype(str)
+
+
+def synthetic_month(rng, locations, month, n):
+    """n rows of one month, all values as strings (no malformed rows yet)"""
+    point = rng.choice(len(locations), n, p=locations['weight'].to_numpy() / locations['weight'].sum())
+    df = locations.iloc[point].drop(columns=['weight']).reset_index(drop=True)
+
+    other_types, other_p = _normalised(OTHER_CRIME_TYPES)
+    outcomes, outcome_p = _normalised(OUTCOMES)
+    burglary = rng.random(n) < BURGLARY_SHARE
+    crime_type = np.where(burglary, 'Burglary', np.array(other_types)[rng.choice(len(other_types), n, p=other_p)])
+    asb = crime_type == 'Anti-social behaviour'
+
+    force = np.where(rng.random(n) < 0.01, 'City of London Police', 'Metropolitan Police Service')
+    df.insert(0, 'Crime ID', np.where(asb, '', crime_ids(rng, n)))
+    df.insert(1, 'Month', month)
+    df.insert(2, 'Reported by', force)
+    df.insert(3, 'Falls within', force)
+    df['Crime type'] = crime_type
+    df['Last outcome category'] = np.where(
+        asb, '', np.array(outcomes)[rng.choice(len(outcomes), n, p=outcome_p)]
+    )
+    df['Context'] = ''
+    return df[COLUMNS]
+
+
+def add_malformed_rows(rng, df, share):
+    """Overwrite a share of rows with malformed ones; returns counts per kind"""
+    bad = np.flatnonzero(rng.random(len(df)) < share)
+    kinds = rng.choice(len(MALFORMED_KINDS), len(bad))
+    counts = {}
+    for k, kind in enumerate(MALFORMED_KINDS):
+        rows = bad[kinds == k]
+        counts[kind] = len(rows)
+        if not len(rows):
+            continue
+        if kind == 'stray_header':
+            df.iloc[rows] = np.tile(np.array(COLUMNS, dtype=object), (len(rows), 1))
+        elif kind == 'bad_coordinates':
+            df.iloc[rows, df.columns.get_loc('Longitude')] = np.where(rng.random(len(rows)) < 0.5, '', 'bad')
+        elif kind == 'outside_london':
+            df.iloc[rows, df.columns.get_loc('Longitude')] = '-2.244644'
+            df.iloc[rows, df.columns.get_loc('Latitude')] = '53.483959'
+        elif kind == 'padded':
+            for col in ('Crime type', 'Location', 'LSOA name'):
+                df.iloc[rows, df.columns.get_loc(col)] = (' ' + df[col].iloc[rows].str.lower() + ' ').to_numpy()
+        elif kind == 'duplicate':
+            df.iloc[rows] = df.iloc[rng.integers(0, len(df), len(rows))].to_numpy()
+    return counts
+
+
+def generate(out_csv, n_rows, start=START_MONTH, end=END_MONTH, seed=0, malformed_share=MALFORMED_SHARE):
+    """Write a synthetic police.uk style CSV of n_rows rows plus its .json sidecar"""
+    start_time = time.time()
+    out_csv = Path(out_csv)
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    locations = synthetic_locations(rng)
+
+    # Slowly growing volumes with a winter peak, like burglary
+    months = pd.period_range(start, end, freq='M')
+    volume = (1 + 0.002 * np.arange(len(months))) * (1 + 0.15 * np.cos(2 * np.pi * (months.month.to_numpy() - 12) / 12))
+    per_month = np.floor(n_rows * volume / volume.sum()).astype(int)
+    per_month[-1] += n_rows - per_month.sum()
+
+    malformed = dict.fromkeys(MALFORMED_KINDS, 0)
+    for i, (month, n) in enumerate(zip(months, per_month)):
+        df = synthetic_month(rng, locations, str(month), n)
+        for kind, count in add_malformed_rows(rng, df, malformed_share).items():
+            malformed[kind] += count
+        df.to_csv(out_csv, index=False, mode='w' if i == 0 else 'a', header=(i == 0))
+        if (i + 1) % 12 == 0 or i == len(months) - 1:
+            print(f"[{i + 1}/{len(months)}] {per_month[:i + 1].sum():,} rows written")
+
+    meta = {
+        'rows': int(n_rows), 'start': str(start), 'end': str(end), 'seed': seed,
+        'burglary_share': BURGLARY_SHARE, 'malformed_share': malformed_share, 'malformed': malformed
+    }
+    with open(f"{out_csv}.json", 'w') as f:
+        json.dump(meta, f, indent=2)
+    print(f"Wrote {n_rows:,} rows to {out_csv} in {time.time() - start_time:.2f} seconds")
+    print(f"Malformed rows: {malformed}")
+
+
+def count_rows(csv_path):
+    """Data rows of a CSV, from the generator's sidecar when there is one"""
+    sidecar = Path(f"{csv_path}.json")
+    if sidecar.exists():
+        with open(sidecar, 'r') as f:
+            return json.load(f)['rows']
+    with open(csv_path, 'rb') as f:
+        return sum(1 for _ in f) - 1
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB (None where unsupported)"""
+    try:
+        import resource
+    except ImportError:
+        # Windows: use psutil if it is installed
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def stage_clean(raw_csv, work_dir, options):
+    stream_clean(raw_csv, work_dir / "cleaned", layout="quick")
+    return count_rows(raw_csv)
+
+
+def stage_ward_join(raw_csv, work_dir, options):
+    wards = PolygonIndex(options['ward_shp'], cache_dir=work_dir / "spatial_index")
+    out_csv = work_dir / "with_wards.csv"
+    rows = 0
+    for path in sorted((work_dir / "cleaned").glob("*.csv")):
+        for chunk in pd.read_csv(path, chunksize=CHUNK_SIZE):
+            gdf = wards.assign(chunk, rename=WARD_COLUMNS)
+            gdf['Month'] = pd.to_datetime(gdf['dt']).dt.strftime('%Y-%m')
+            gdf = gdf.drop(columns=['dt'])
+            gdf.to_csv(out_csv, index=False, mode='w' if rows == 0 else 'a', header=(rows == 0))
+            rows += len(gdf)
+    return rows
+
+
+def stage_rolling_counts(raw_csv, work_dir, options):
+    df = pd.read_csv(work_dir / "with_wards.csv", low_memory=False)
+    counts = rolling_neighbour_features(
+        df['latitude'].to_numpy(), df['longitude'].to_numpy(), pd.to_datetime(df['Month']),
+        workers=options['workers']
+    )
+    for col in counts.columns:
+        df[col] = counts[col].to_numpy()
+    df.to_csv(work_dir / "with_counts.csv", index=False)
+    return len(df)
+
+
+def stage_split_index(raw_csv, work_dir, options):
+    split_by_year(work_dir / "with_counts.csv", work_dir / "yearly")
+    indices = CSVIndexManager(work_dir / "yearly").indices
+    return sum(index['row_count'] for index in indices.values())
+
+
+STAGES = {
+    'clean': stage_clean,
+    'ward_join': stage_ward_join,
+    'rolling_counts': stage_rolling_counts,
+    'split_index': stage_split_index
+}
+
+
+def _run_stage(name, args, queue):
+    """Process target: run one stage and report its timing and memory"""
+    base_mb = peak_memory_mb()
+    start = time.perf_counter()
+    try:
+        rows = STAGES[name](*args)
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+        raise
+    queue.put({
+        'rows': rows,
+        'seconds': time.perf_counter() - start,
+        'base_mb': base_mb,
+        'peak_mb': peak_memory_mb()
+    })
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(raw_csv, work_dir=WORK_DIR, ward_shp=WARD_SHP, workers=1, results_csv=RESULTS_CSV, keep=False):
+    """Time every stage on raw_csv; returns the results table"""
+    work_dir = Path(work_dir)
+    # Start cold: no cleaned files or polygon index from an earlier run
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+
+    # Spawned processes, so every stage starts from a fresh interpreter
+    ctx = mp.get_context('spawn')
+    options = {'ward_shp': Path(ward_shp), 'workers': workers}
+    results = []
+    for name in STAGES:
+        print(f"=== {name} ===")
+        queue = ctx.Queue()
+        process = ctx.Process(target=_run_stage, args=(name, (raw_csv, work_dir, options), queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        if 'error' in result:
+            raise RuntimeError(f"Stage {name} failed: {result['error']}")
+        results.append({
+            'stage': name,
+            'rows': result['rows'],
+            'seconds': result['seconds'],
+            'rows_per_sec': result['rows'] / result['seconds'] if result['seconds'] else None,
+            'base_mb': result['base_mb'],
+            'peak_mb': result['peak_mb']
+        })
+
+    table = pd.DataFrame(results)
+    table.insert(0, 'run_at', datetime.now().isoformat(timespec='seconds'))
+    table.insert(1, 'git_rev', git_revision())
+    table.insert(2, 'input', Path(raw_csv).name)
+    table.insert(3, 'raw_rows', count_rows(raw_csv))
+    table['workers'] = workers
+
+    results_csv = Path(results_csv)
+    results_csv.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(results_csv, index=False, mode='a', header=not results_csv.exists())
+    if not keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help="write a synthetic police.uk style CSV")
+    gen.add_argument('--rows', type=int, default=1_000_000)
+    gen.add_argument('--out', required=True)
+    gen.add_argument('--start', default=START_MONTH, help="first month, YYYY-MM")
+    gen.add_argument('--end', default=END_MONTH, help="last month, YYYY-MM")
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('--malformed', type=float, default=MALFORMED_SHARE, help="share of malformed rows")
+
+    bench = subparsers.add_parser('run', help="time every ingestion stage on a raw CSV")
+    bench.add_argument('raw_csv')
+    bench.add_argument('--work-dir', default=str(WORK_DIR))
+    bench.add_argument('--ward-shp', default=str(WARD_SHP))
+    bench.add_argument('--workers', type=int, default=1, help="processes for the rolling counts")
+    bench.add_argument('--results', default=str(RESULTS_CSV))
+    bench.add_argument('--keep', action='store_true', help="keep the intermediate files")
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        generate(args.out, args.rows, args.start, args.end, args.seed, args.malformed)
+    else:
+        table = run(args.raw_csv, args.work_dir, args.ward_shp, args.workers, args.results, args.keep)
+        print(table[['stage', 'rows', 'seconds', 'rows_per_sec', 'peak_mb']].to_string(
+            index=False, float_format=lambda v: f"{v:,.1f}"
+        ))
+        print(f"Results appended to {args.results}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import pandas as pd
 from scipy.stats import pearsonr
+
+from feature_store import read_features
 ethnicity_df = pd.read_excel("Ethnic group.xlsx", sheet_name="2021")
-features_df = pd.read_csv("lsoa_features_final.csv")
+features_df = read_features(['LSOA code', 'month', 'y_true'])
 pd.set_option('display.max_columns', None)
 
 #print(ethnicity_df.head(1))
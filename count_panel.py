@@ -0,0 +1,95 @@
+"""
+count_panel.py
+
+Sparse LSOA x month crime-count panel.
+
+Most LSOA-months have no burglary, so the counts are kept as a CSR matrix
+(one row per LSOA, one column per month, only the non-zero months stored)
+instead of the full dense grid. Dense counts are only materialized for the
+months a consumer asks for, optionally shifted by a lag:
+
+    counts = CountPanel.load("outputs/feature_state/crime_counts.npz")
+    last_year = counts.dense("2024-03", "2025-02")
+    lag12 = counts.dense("2024-03", "2025-02", lag=12)
+
+Build_features_table.py builds the panel from the crime rows, takes its
+counts and lags from it and saves it with the feature state; every
+`--update` appends the new month as one more column.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class CountPanel:
+    """Crime counts per LSOA x month, stored as CSR"""
+
+    def __init__(self, counts, lsoa_ids, first_month):
+        self.counts = sparse.csr_matrix(counts, dtype=np.int64)
+        self.lsoa_ids = np.asarray(lsoa_ids)
+        self.first_month = pd.Period(first_month, freq='M')
+
+    @classmethod
+    def from_events(cls, row, col, lsoa_ids, first_month, n_months):
+        """
+        Count events at (row, col): row = position in lsoa_ids, col = months
+        since first_month
+        """
+        counts = sparse.csr_matrix(
+            (np.ones(len(row), dtype=np.int64), (row, col)),
+            shape=(len(lsoa_ids), n_months)
+        )
+        counts.sum_duplicates()
+        return cls(counts, lsoa_ids, first_month)
+
+    @property
+    def n_months(self):
+        return self.counts.shape[1]
+
+    @property
+    def months(self):
+        return pd.period_range(self.first_month, periods=self.n_months, freq='M')
+
+    def _column(self, month, default):
+        """Column of a month (may lie outside the panel), default if None"""
+        if month is None:
+            return default
+        return (pd.Period(month, freq='M') - self.first_month).n
+
+    def dense(self, start=None, stop=None, lag=0):
+        """
+        Dense LSOA x month counts of the months start..stop (inclusive,
+        'YYYY-MM' or Period; None for the panel's ends), each taken `lag`
+        months earlier. Months outside the panel count 0.
+        """
+        first = self._column(start, 0) - lag
+        last = self._column(stop, self.n_months - 1) - lag
+        out = np.zeros((len(self.lsoa_ids), max(last - first + 1, 0)), dtype=np.int64)
+        lo, hi = max(first, 0), min(last + 1, self.n_months)
+        if hi > lo:
+            out[:, lo - first:hi - first] = self.counts[:, lo:hi].toarray()
+        return out
+
+    def append_month(self, month_counts):
+        """Add the counts of the month after the last one (one per LSOA)"""
+        column = sparse.csr_matrix(np.asarray(month_counts, dtype=np.int64)[:, None])
+        self.counts = sparse.hstack([self.counts, column], format='csr')
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            path,
+            data=self.counts.data, indices=self.counts.indices, indptr=self.counts.indptr,
+            shape=np.array(self.counts.shape), lsoa_ids=self.lsoa_ids,
+            first_month=np.array(str(self.first_month))
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            counts = sparse.csr_matrix((npz['data'], npz['indices'], npz['indptr']), shape=tuple(npz['shape']))
+            return cls(counts, npz['lsoa_ids'], str(npz['first_month']))
@@ -0,0 +1,165 @@
+"""
+dedup.py
+
+Exact cross-chunk / cross-load deduplication with a compact set of 64-bit
+row hashes.
+
+Each row is reduced to one uint64 (pandas' hash of the chosen key columns),
+so remembering every row ever kept costs 8 bytes per row instead of the row
+itself. The set is a handful of sorted uint64 runs: each batch of new hashes
+becomes a run, and runs of similar size are merged (like an LSM tree), so
+adding stays cheap and a lookup is one binary search per run.
+
+With a spill directory, runs larger than `max_memory` hashes are written to
+.npy files and memory-mapped, so multi-year backfills do not have to fit in
+RAM, and the set persists: the next chunked run or incremental monthly load
+opens the same directory and keeps deduplicating against everything loaded
+before.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Hashes kept in RAM per run before it is spilled (8 bytes each, ~128 MB)
+MAX_MEMORY_HASHES = 16_000_000
+
+# Key columns of a cleaned (quick layout) row: the whole row, or a crime's
+# id, location and month
+DEDUP_KEYS = {
+    'row': None,
+    'crime': ['Crime ID', 'longitude', 'latitude', 'dt']
+}
+
+# Raw text columns; duplicates are judged on their parsed versions
+RAW_COLUMNS = ['Longitude', 'Latitude', 'Month']
+
+# police.uk coordinates are published with 6 decimals
+COORD_DECIMALS = 6
+
+
+def key_frame(df, key='row'):
+    """
+    Columns of a cleaned frame that identify a row under DEDUP_KEYS[key],
+    normalised so the same crime hashes the same whether it comes from a raw
+    export or back from the store
+    """
+    if key not in DEDUP_KEYS:
+        raise ValueError(f"Unknown dedup key: {key}")
+    columns = DEDUP_KEYS[key]
+    if columns is None:
+        columns = [col for col in df.columns if col not in RAW_COLUMNS]
+    frame = df[columns]
+
+    normalised = {}
+    for col in ('longitude', 'latitude'):
+        if col in frame:
+            normalised[col] = frame[col].round(COORD_DECIMALS)
+    if 'dt' in frame:
+        normalised['dt'] = frame['dt'].astype('datetime64[ns]')
+    if key == 'crime':
+        normalised['Crime ID'] = frame['Crime ID'].fillna('').astype(str)
+    return frame.assign(**normalised)
+
+
+def row_hashes(frame):
+    """uint64 hash of each row of frame"""
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype=np.uint64)
+
+
+def _contains(run, hashes):
+    """Membership of hashes in one sorted run"""
+    pos = np.searchsorted(run, hashes)
+    found = pos < len(run)
+    found[found] = run[pos[found]] == hashes[found]
+    return found
+
+
+class RowHashSet:
+    """Set of uint64 row hashes stored as sorted runs, optionally spilled to disk"""
+
+    def __init__(self, spill_dir=None, max_memory=MAX_MEMORY_HASHES):
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self.max_memory = max_memory
+        self.runs = []          # sorted uint64 arrays, largest first
+        self.files = []         # backing .npy file per run (None if in memory)
+        self._merged_files = [] # spilled runs merged away, deleted on save()
+        self._next_file = 0
+
+        if self.spill_dir is not None and self.spill_dir.exists():
+            for path in sorted(self.spill_dir.glob("run_*.npy")):
+                self.runs.append(np.load(path, mmap_mode='r'))
+                self.files.append(path)
+                self._next_file = max(self._next_file, int(path.stem.split('_')[1]) + 1)
+            order = np.argsort([-len(run) for run in self.runs], kind='stable')
+            self.runs = [self.runs[i] for i in order]
+            self.files = [self.files[i] for i in order]
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes):
+        """Boolean mask: which hashes are already in the set"""
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            found |= _contains(run, hashes)
+        return found
+
+    def add_new(self, hashes):
+        """
+        Mask of hashes that are new (not in the set and not repeated earlier
+        in `hashes`); the new ones are added to the set
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        new = ~pd.Series(hashes).duplicated().to_numpy()
+        new &= ~self.contains(hashes)
+        if new.any():
+            self.runs.append(np.sort(hashes[new]))
+            self.files.append(None)
+            self._merge_runs()
+        return new
+
+    def filter_new(self, df, key='row'):
+        """Mask of cleaned df rows not seen before under `key`; records them"""
+        return self.add_new(row_hashes(key_frame(df, key)))
+
+    def _merge_runs(self):
+        """Merge the newest run into its predecessor while it is at least as large"""
+        while len(self.runs) > 1 and len(self.runs[-1]) >= len(self.runs[-2]):
+            if len(self.runs[-1]) + len(self.runs[-2]) > self.max_memory and self.spill_dir is not None:
+                # Too big to merge in memory: spill the newest run as it is
+                self._spill(len(self.runs) - 1)
+                break
+            merged = np.union1d(self.runs[-2], self.runs[-1])
+            self._merged_files += [path for path in self.files[-2:] if path is not None]
+            self.runs[-2:] = [merged]
+            self.files[-2:] = [None]
+        if self.spill_dir is not None and len(self.runs[-1]) > self.max_memory:
+            self._spill(len(self.runs) - 1)
+
+    def _spill(self, i):
+        """Write run i to the spill directory and memory-map it"""
+        if self.files[i] is not None:
+            return
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spill_dir / f"run_{self._next_file:06d}.npy"
+        self._next_file += 1
+        np.save(path, self.runs[i])
+        self.runs[i] = np.load(path, mmap_mode='r')
+        self.files[i] = path
+
+    def save(self):
+        """
+        Persist every in-memory run to the spill directory. Files of runs
+        merged since the last save are only removed afterwards, so the
+        directory always holds a complete set.
+        """
+        if self.spill_dir is None:
+            raise ValueError("RowHashSet has no spill directory to save to")
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        for i in range(len(self.runs)):
+            self._spill(i)
+        for path in self._merged_files:
+            path.unlink()
+        self._merged_files = []
@@ -0,0 +1,147 @@
+"""
+feature_store.py
+
+Columnar store of the LSOA x month feature table built by
+Build_features_table.py. One Parquet dataset holds every raw feature column
+plus the per-month z-scored `_z` columns; it replaces the raw, z-scored and
+combined CSVs, which repeated most of the same columns three times.
+
+Parquet is column-oriented, so model scripts read (and decode) only the
+columns they use:
+    df = read_features(['LSOA code', 'month', 'y_true', 'crime_count_lag1_z'])
+With z_scored=True the dynamic columns come back holding their `_z` values,
+which is the layout of the old lsoa_features_final.csv.
+
+A full build writes part-00000.parquet; every `--update` month appends the
+next part, so earlier rows are never rewritten.
+
+The mean / std behind every `_z` column (per feature and month, or 'all'
+for months_since_last_crime) are kept in zscore_stats.parquet, so new data
+can be z-scored at inference time with exactly the training statistics:
+    X_z = apply_zscore(X, read_zscore_stats())
+"""
+
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+FEATURE_STORE = Path("outputs/feature_store")
+ZSCORE_STATS = "zscore_stats.parquet"
+
+
+def _parts(store_dir):
+    parts = sorted(Path(store_dir).glob("part-*.parquet"))
+    if not parts:
+        raise FileNotFoundError(f"No feature store in {store_dir}; run Build_features_table.py first")
+    return parts
+
+
+def write_features(features, store_dir=FEATURE_STORE, append=False):
+    """
+    Write the feature table as a new part of the store; without append the
+    existing parts are removed first
+
+    Returns:
+        Path of the written part
+    """
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    parts = sorted(store_dir.glob("part-*.parquet"))
+    if not append:
+        for part in parts:
+            part.unlink()
+        parts = []
+    number = int(parts[-1].stem.split('-')[1]) + 1 if parts else 0
+    path = store_dir / f"part-{number:05d}.parquet"
+    # Months are stored as 'YYYY-MM' strings, as in the old CSVs
+    features.assign(month=features['month'].astype(str)).to_parquet(path, index=False)
+    return path
+
+
+def feature_columns(store_dir=FEATURE_STORE):
+    """Column names of the store"""
+    return pq.read_schema(_parts(store_dir)[0]).names
+
+
+def _nullable_columns(part):
+    """Columns of a part that may hold missing values (per row-group statistics)"""
+    metadata = pq.ParquetFile(part).metadata
+    nullable = set()
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            stats = column.statistics
+            if stats is None or not stats.has_null_count or stats.null_count > 0:
+                nullable.add(column.path_in_schema)
+    return nullable
+
+
+def read_features(columns=None, store_dir=FEATURE_STORE, z_scored=False, with_nullable=False):
+    """
+    Read the feature table, only `columns` (all columns if None).
+
+    Args:
+        z_scored: return each requested column that has a `_z` version with
+            the z-scored values, under its own name
+        with_nullable: also return every column that holds missing values,
+            so df.dropna() drops the same rows as on the full table
+    """
+    all_columns = feature_columns(store_dir)
+    columns = list(all_columns if columns is None else columns)
+    source = {c: c + '_z' if z_scored and c + '_z' in all_columns else c for c in columns}
+
+    parts = _parts(store_dir)
+    if with_nullable:
+        nullable = set().union(*[_nullable_columns(part) for part in parts])
+        source.update({c: c for c in all_columns if c in nullable and c not in source})
+
+    read = list(dict.fromkeys(source.values()))
+    frames = [pd.read_parquet(part, columns=read) for part in parts]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return pd.DataFrame({c: df[src] for c, src in source.items()})
+
+
+def write_zscore_stats(stats, store_dir=FEATURE_STORE, append=False):
+    """
+    Save the z-score stats (feature, month, mean, std); with append they
+    replace the stored rows of the same feature and month and keep the rest
+    """
+    Path(store_dir).mkdir(parents=True, exist_ok=True)
+    path = Path(store_dir) / ZSCORE_STATS
+    if append and path.exists():
+        stored = pd.read_parquet(path)
+        key = ['feature', 'month']
+        replaced = stored.set_index(key).index.isin(stats.set_index(key).index)
+        stats = pd.concat([stored[~replaced], stats], ignore_index=True)
+    stats.to_parquet(path, index=False)
+
+
+def read_zscore_stats(store_dir=FEATURE_STORE):
+    """Z-score stats of the store, one row per feature and month"""
+    return pd.read_parquet(Path(store_dir) / ZSCORE_STATS)
+
+
+def apply_zscore(df, stats, month=None):
+    """
+    Z-score the raw feature columns of df (as stored in the feature store)
+    with saved stats: every row with the stats of its own 'month', or all
+    rows with those of `month` (e.g. the last training month for a month
+    the stats do not cover). Features with an 'all' row use it for every row.
+
+    Returns:
+        DataFrame of the `<feature>_z` columns, on df's index
+    """
+    out = pd.DataFrame(index=df.index)
+    for feature, rows in stats.groupby('feature', sort=False):
+        if feature not in df:
+            continue
+        rows = rows.set_index('month')
+        if 'all' in rows.index:
+            mean, std = rows.loc['all', 'mean'], rows.loc['all', 'std']
+        else:
+            key = df['month'].astype(str) if month is None else pd.Series(str(month), index=df.index)
+            mean, std = key.map(rows['mean']), key.map(rows['std'])
+        out[feature + '_z'] = (df[feature] - mean) / std
+    return out
@@ -0,0 +1,106 @@
+"""
+gcn_dataset.py
+
+Monthly LSOA graphs for the GCN as one stacked tensor.
+
+The feature table is pivoted once into a contiguous (months x nodes x
+features) tensor X and a (months x nodes) target tensor y that share one
+edge_index, instead of filtering and reindexing the table once per month.
+Moving the dataset to the device moves X, y and edge_index once; every month
+is then a zero-copy view:
+
+    dataset = MonthlyGraphDataset.from_frame(feat_df, node_codes, feat_cols, edge_index)
+    dataset = dataset.to(device)
+    train, val = dataset[:-2], dataset[-2:-1]       # views, no copies
+    for batch in train.batches(months_per_batch=4):
+        raw_pred, _ = model(batch)                  # batch.x: (4 * nodes, features)
+
+With months_per_batch > 1 consecutive months are stacked as one graph with
+a block-diagonal adjacency (the edge_index repeated with node offsets), so
+each month only sees its own neighbours.
+"""
+
+import numpy as np
+import pandas as pd
+import torch
+from torch_geometric.data import Data
+
+
+class MonthlyGraphDataset:
+    """Per-month node features and targets on a fixed graph"""
+
+    def __init__(self, X, y, edge_index, months, codes):
+        self.X = X
+        self.y = y
+        self.edge_index = edge_index
+        self.months = list(months)
+        self.codes = list(codes)
+        self._batch_edges = {}
+
+    @classmethod
+    def from_frame(cls, df, codes, feat_cols, edge_index, months=None, target='y_true',
+                   code_col='LSOA21CD', month_col='month'):
+        """
+        Pivot a long LSOA x month table (one row per LSOA and month).
+
+        Args:
+            codes: LSOA code of every graph node
+            months: months to include, in order (default: all, sorted)
+        Rows of other LSOAs or months are ignored; a node without a row in a
+        month gets NaN, as a per-month reindex would.
+        """
+        months = sorted(df[month_col].unique()) if months is None else list(months)
+        node = pd.Index(codes).get_indexer(df[code_col])
+        month_pos = pd.Index(months).get_indexer(df[month_col])
+        rows = (node >= 0) & (month_pos >= 0)
+
+        X = np.full((len(months), len(codes), len(feat_cols)), np.nan, dtype=np.float32)
+        y = np.full((len(months), len(codes)), np.nan, dtype=np.float32)
+        X[month_pos[rows], node[rows]] = df[feat_cols].to_numpy(dtype=np.float32)[rows]
+        y[month_pos[rows], node[rows]] = df[target].to_numpy(dtype=np.float32)[rows]
+        return cls(torch.from_numpy(X), torch.from_numpy(y), torch.as_tensor(edge_index), months, codes)
+
+    @property
+    def n_nodes(self):
+        return self.X.shape[1]
+
+    def __len__(self):
+        return len(self.months)
+
+    def __getitem__(self, key):
+        """Data of one month, or a dataset view of a slice of months"""
+        if isinstance(key, slice):
+            return MonthlyGraphDataset(self.X[key], self.y[key], self.edge_index, self.months[key], self.codes)
+        return Data(x=self.X[key], edge_index=self.edge_index, y=self.y[key])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def to(self, device):
+        """Dataset on `device` (X, y and edge_index moved once)"""
+        return MonthlyGraphDataset(
+            self.X.to(device), self.y.to(device), self.edge_index.to(device), self.months, self.codes
+        )
+
+    def _block_edges(self, k):
+        """edge_index of k stacked months: a block-diagonal adjacency"""
+        if k not in self._batch_edges:
+            offsets = torch.arange(k, device=self.edge_index.device) * self.n_nodes
+            self._batch_edges[k] = (self.edge_index.unsqueeze(1) + offsets.view(1, k, 1)).reshape(2, -1)
+        return self._batch_edges[k]
+
+    def batches(self, months_per_batch=1):
+        """
+        Data per chunk of consecutive months; a chunk of k months holds
+        k * n_nodes nodes (month-major) and the block-diagonal edge_index
+        """
+        for start in range(0, len(self), months_per_batch):
+            stop = min(start + months_per_batch, len(self))
+            if stop - start == 1:
+                yield self[start]
+                continue
+            yield Data(
+                x=self.X[start:stop].reshape(-1, self.X.shape[2]),
+                edge_index=self._block_edges(stop - start),
+                y=self.y[start:stop].reshape(-1)
+            )
@@ -10,16 +10,19 @@ gcn_lsoa_mse.py
 5) Extracts the hidden layer (h1) + y_true as features into CSV.
 """
 
-import numpy as np
 import pandas as pd
-import geopandas as gpd
-import networkx as nx
 import torch
 import torch.nn.functional as F
 
-from torch_geometric.data import Data
 from torch_geometric.nn import GCNConv
-from torch_geometric.utils import from_networkx
+
+from gcn_dataset import MonthlyGraphDataset
+from lsoa_graph import LsoaGraph
+from spatial_lag import SpatialLag
+
+# Training months per optimizer step; more than 1 stacks consecutive months
+# into one block-diagonal graph (see gcn_dataset.py)
+MONTHS_PER_BATCH = 1
 
 
 class GCN2_MSE(torch.nn.Module):
@@ -90,52 +93,16 @@ def main():
     # ────────────────────────────────────────────────────────────────
 
     # 2) Compute neighbor-lag feature (avg of lag1 over immediate neighbors)
-    lag1_df = feat_df[["LSOA21CD", "month", "crime_count_lag1"]].drop_duplicates(
-        subset=["LSOA21CD", "month"]
-    )
-
+    # Contiguity graph of the LSOAs in the feature table (cached per shapefile)
     shp_path = "LSOA_boundries/LSOA_2021_EW_BFE_V10.shp"
-    full_gdf = gpd.read_file(shp_path).to_crs(epsg=27700)
-    codes    = feat_df["LSOA21CD"].unique().tolist()
-    gdf      = full_gdf[full_gdf["LSOA21CD"].isin(codes)].reset_index(drop=True)
-
-    # Build adjacency map: LSOA code → list of neighbor LSOA codes
-    sindex = gdf.sindex
-    neighbors_map = {}
-    for idx, geom in gdf.geometry.items():
-        code = gdf.at[idx, "LSOA21CD"]
-        nbrs = []
-        for j in sindex.intersection(geom.bounds):
-            if j != idx and geom.touches(gdf.geometry.iloc[j]):
-                nbrs.append(gdf.at[j, "LSOA21CD"])
-        neighbors_map[code] = nbrs
-
-    def compute_nbr_avg_lag1(sub_df):
-        sub_dict = sub_df.set_index("LSOA21CD")["crime_count_lag1"].to_dict()
-        out_mean = {}
-        for code_i, val in sub_dict.items():
-            nbr_list = neighbors_map.get(code_i, [])
-            if not nbr_list:
-                out_mean[code_i] = 0.0
-            else:
-                vals = [sub_dict.get(nb, 0.0) for nb in nbr_list]
-                out_mean[code_i] = float(np.mean(vals))
-        return pd.Series(out_mean)
-
-    nbr_avg_list = []
-    for mo in sorted(lag1_df["month"].unique()):
-        df_month = lag1_df[lag1_df["month"] == mo]
-        series_month = compute_nbr_avg_lag1(df_month)
-        df_out = pd.DataFrame({
-            "LSOA21CD": list(series_month.index),
-            "month": mo,
-            "nbr_avg_lag1": list(series_month.values)
-        })
-        nbr_avg_list.append(df_out)
-    nbr_avg_df = pd.concat(nbr_avg_list, ignore_index=True)
-
-    feat_df = feat_df.merge(nbr_avg_df, on=["LSOA21CD", "month"], how="left")
-    feat_df["nbr_avg_lag1"] = feat_df["nbr_avg_lag1"].fillna(0.0)
+    graph    = LsoaGraph.from_shapefile(shp_path).subgraph(feat_df["LSOA21CD"].unique())
+
+    # One sparse W @ X product over the LSOA x month lag1 matrix
+    # (neighbors without a row that month count as 0)
+    spatial_lag = SpatialLag.from_edge_index(graph.edge_index, graph.n_nodes)
+    feat_df["nbr_avg_lag1"] = spatial_lag.table(
+        feat_df, graph.codes, ["crime_count_lag1"], code_col="LSOA21CD"
+    )["nbr_mean_crime_count_lag1"]
 
     # 3) Define feature columns (INCLUDING rank_last_year & months_since_last_crime)
     feat_cols = [
@@ -151,43 +118,24 @@ def main():
         "months_since_last_crime",
     ]
 
-    # 4) Build adjacency graph for the GCN (2-hop)
-    codes = feat_df["LSOA21CD"].unique().tolist()
-    gdf   = full_gdf[full_gdf["LSOA21CD"].isin(codes)].reset_index(drop=True)
-
-    sidx = gdf.sindex
-    Gnx  = nx.Graph()
-    for idx in gdf.index:
-        Gnx.add_node(idx)
-    for idx, geom in gdf.geometry.items():
-        for j in sidx.intersection(geom.bounds):
-            if j != idx and geom.touches(gdf.geometry.iloc[j]):
-                Gnx.add_edge(idx, j)
-
-    pyg        = from_networkx(Gnx)
-    edge_index = pyg.edge_index
-    node_codes = gdf["LSOA21CD"].tolist()
-
-    # 5) Prepare one Data object per month (all but the final held-out month)
-    months    = sorted(feat_df["month"].unique())
-    data_list = []
-    for mo in months[:-1]:
-        sub = (
-            feat_df[feat_df["month"] == mo]
-            .set_index("LSOA21CD")
-            .reindex(node_codes)
-        )
-        x = torch.tensor(sub[feat_cols].values, dtype=torch.float)
-        y = torch.tensor(sub["y_true"].values, dtype=torch.float)
-        data_list.append(Data(x=x, edge_index=edge_index, y=y))
+    # 4) Adjacency of the same graph for the GCN (2-hop)
+    edge_index = torch.from_numpy(graph.edge_index)
+    node_codes = graph.codes.tolist()
+
+    # 5) Stack all months but the final held-out one into a single
+    #    (months x nodes x features) tensor, moved to the device once
+    device  = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    months  = sorted(feat_df["month"].unique())
+    dataset = MonthlyGraphDataset.from_frame(
+        feat_df, node_codes, feat_cols, edge_index, months=months[:-1]
+    ).to(device)
 
-    # 6) Split into train vs. validation (last two months used as val/test)
-    train_data_list = data_list[:-2]   # all except the last two
-    val_data_list   = data_list[-2:-1] # second-to-last month
-    test_data_list  = data_list[-1:]   # last month
+    # 6) Split into train vs. validation (last two months used as val/test); views, no copies
+    train_data = dataset[:-2]   # all except the last two
+    val_data   = dataset[-2:-1] # second-to-last month
+    test_data  = dataset[-1:]   # last month
 
     # 7) Initialize model, optimizer, scheduler, and MSE loss
-    device    = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model     = GCN2_MSE(in_ch=len(feat_cols), hid=64, out_ch=1, dropout=0.3).to(device)
 
     optimizer = torch.optim.Adam(model.parameters(), lr=0.005, weight_decay=1e-6)
@@ -203,8 +151,8 @@ def main():
     for epoch in range(1, 21):
         model.train()
         train_loss = 0.0
-        for data in train_data_list:
-            batch = data.to(device)
+        n_batches  = 0
+        for batch in train_data.batches(MONTHS_PER_BATCH):
             optimizer.zero_grad()
 
             raw_pred, _ = model(batch)  # shape = [num_nodes]
@@ -213,18 +161,18 @@ def main():
             loss.backward()
             optimizer.step()
             train_loss += loss.item()
+            n_batches  += 1
 
-        train_loss /= len(train_data_list)
+        train_loss /= n_batches
 
-        # Compute validation loss (MSE) on val_data_list
+        # Compute validation loss (MSE) on val_data
         model.eval()
         val_loss = 0.0
         with torch.no_grad():
-            for data in val_data_list:
-                batch = data.to(device)
+            for batch in val_data:
                 raw_pred, _ = model(batch)
                 val_loss += mse_loss_fn(raw_pred, batch.y).item()
-        val_loss /= len(val_data_list)
+        val_loss /= len(val_data)
 
         # Step the scheduler on the validation MSE
         scheduler.step(val_loss)
@@ -234,7 +182,7 @@ def main():
     # 9) Final evaluation on test month (MSE)
     model.eval()
     with torch.no_grad():
-        batch = test_data_list[0].to(device)
+        batch = test_data[0]
         raw_pred, h1 = model(batch)
         test_mse_raw = float(mse_loss_fn(raw_pred, batch.y))
     print(f"Final Test Month {months[-1]} | Test MSE: {test_mse_raw:.3f}")
@@ -245,8 +193,7 @@ def main():
 
     # 10) Extract hidden embeddings (h1) + y_true → CSV
     all_dfs = []
-    for mo, data in zip(months[:-1], data_list):
-        batch = data.to(device)
+    for mo, batch in zip(dataset.months, dataset):
         model.eval()
         with torch.no_grad():
             _, h1 = model(batch)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+ingest_month.py
+
+Incrementally ingest one newly published police.uk month into the
+partitioned yearly store (data/yearly_burglaries) instead of re-running
+quick_clean.py, crimes_to_wards.py, add_crimes_in_range.py and
+split_burglaries_by_year.py over the whole history.
+
+For the new month only, it:
+  1. cleans the raw street-level export (same steps as stream_clean.py) and
+     drops crimes already in the store, by Crime ID + location + month,
+     using the persistent hash set in <data-dir>/row_hashes
+  2. attaches ward attributes from the cached ward polygon index
+  3. computes num_crimes_past_year_1km (and any other radius / window
+     counts) against just the trailing months already in the store
+  4. appends the rows to that year's file and updates the CSV index and
+     schema registry in place
+
+A month that was already ingested (e.g. republished with late records) can
+be ingested again: only its new crimes are appended, as another byte range
+of that month.
+
+Usage:
+    python ingest_month.py 2025-03-metropolitan-street.csv [--data-dir ...]
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from area_assign import PolygonIndex, WARD_COLUMNS
+from dedup import RowHashSet
+from ProjectDashboard.backend.optimized_csv import (
+    CSVIndexManager, CSVSchemaRegistry, load_burglary_data
+)
+from spatial_counts import rolling_neighbour_features
+from stream_clean import clean_chunk
+
+DATA_DIR = Path("data/yearly_burglaries")
+WARD_SHP = Path("London-wards-2018-ESRI/London_Ward.shp")
+HASH_DIR_NAME = "row_hashes"
+
+# Rows per chunk when hashing an existing store for the first time
+CHUNK_SIZE = 500_000
+
+# Same settings as add_crimes_in_range.py
+RADII_KM = [1.0]
+WINDOWS_MONTHS = [12]
+
+
+def clean_raw_month(raw_csv):
+    """Same cleaning steps as stream_clean.py, for a single month's export"""
+    df = pd.read_csv(raw_csv, dtype=str, na_values=["", " "])
+    return clean_chunk(df).reset_index(drop=True)
+
+
+def open_row_hashes(data_dir):
+    """
+    Persistent hash set of the crimes in the store. Built from the yearly
+    files the first time, then kept up to date by every ingest.
+    """
+    hash_dir = Path(data_dir) / HASH_DIR_NAME
+    seen = RowHashSet(hash_dir)
+    if not hash_dir.exists():
+        for file_path in sorted(Path(data_dir).glob("london_burglaries_*.csv")):
+            reader = pd.read_csv(file_path, usecols=['Crime ID', 'Month', 'longitude', 'latitude'],
+                                 dtype={'Crime ID': str}, chunksize=CHUNK_SIZE)
+            for chunk in reader:
+                seen.filter_new(chunk.assign(dt=pd.to_datetime(chunk['Month'])), key='crime')
+        seen.save()
+        print(f"Hashed {len(seen):,} stored crimes into {hash_dir}")
+    return seen
+
+
+def assign_wards(df, ward_shp):
+    """Same ward assignment as crimes_to_wards.py (index is reused across months)"""
+    return PolygonIndex(ward_shp).assign(df, rename=WARD_COLUMNS)
+
+
+def load_trailing_points(index_manager, schema_registry, month):
+    """
+    Coordinates and months of the max(WINDOWS_MONTHS) months before `month`,
+    plus any rows of `month` itself already in the store
+    """
+    frames = []
+    for back in range(max(WINDOWS_MONTHS), -1, -1):
+        period = month - back
+        file_path = index_manager.data_dir / f"london_burglaries_{period.year}.csv"
+        if not file_path.exists():
+            continue
+        frames.append(load_burglary_data(
+            file_path,
+            columns=['Month', 'longitude', 'latitude'],
+            filters={'Month': (period.year, period.month)},
+            index_manager=index_manager,
+            schema_registry=schema_registry
+        ))
+
+    if not frames:
+        return pd.DataFrame(columns=['Month', 'longitude', 'latitude'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def count_recent_neighbours(new_df, history_df):
+    """
+    Rolling count columns (num_crimes_past_year_1km, ...) for the new
+    month's rows.
+
+    Matches add_crimes_in_range.py: every incident of the previous months
+    within the radius counts, plus the incidents of the same month that come
+    earlier in file order (including those already stored).
+    """
+    points = pd.concat([
+        history_df[['latitude', 'longitude']].assign(month=pd.to_datetime(history_df['Month'])),
+        new_df[['latitude', 'longitude']].assign(month=new_df['dt'])
+    ], ignore_index=True)
+    counts = rolling_neighbour_features(
+        points['latitude'].to_numpy(), points['longitude'].to_numpy(), points['month'],
+        radii_km=RADII_KM, windows_months=WINDOWS_MONTHS,
+        first_month=new_df['dt'].iloc[0]
+    )
+    return counts.iloc[len(history_df):].reset_index(drop=True)
+
+
+def append_month(df, month, index_manager, schema_registry):
+    """Append one month's rows to its yearly file and update index + schema in place"""
+    file_path = index_manager.data_dir / f"london_burglaries_{month.year}.csv"
+    schema = schema_registry.get_schema(file_path) if file_path.exists() else None
+
+    if schema is None:
+        # First month of a new year: reuse the layout of the latest yearly file
+        existing = sorted(index_manager.data_dir.glob("london_burglaries_*.csv"))
+        template = schema_registry.get_schema(existing[-1]) if existing else None
+        columns = template['columns'] if template else df.columns.tolist()
+    else:
+        columns = schema['columns']
+
+    out = df.reindex(columns=columns)
+    header = out.iloc[:0].to_csv(index=False, lineterminator='\n').encode('utf-8')
+    data = out.to_csv(header=False, index=False, lineterminator='\n').encode('utf-8')
+
+    new_file = not file_path.exists()
+    with open(file_path, 'ab') as f:
+        if new_file:
+            f.write(header)
+        start = f.tell()
+        f.write(data)
+        end = f.tell()
+
+    month_key = str(month)
+    file_stats = os.stat(file_path)
+    index = index_manager.indices.get(file_path.name) or {
+        'header_end': len(header),
+        'months': [],
+        'month_offsets': {},
+        'row_count': 0
+    }
+    index['month_offsets'].setdefault(month_key, []).append([start, end])
+    index['months'] = sorted(set(index['months']) | {month_key})
+    index['first_month'] = index['months'][0]
+    index['last_month'] = index['months'][-1]
+    index['size_bytes'] = file_stats.st_size
+    index['modified_time'] = file_stats.st_mtime
+    if 'row_count' in index:
+        index['row_count'] += len(out)
+    index_manager.indices[file_path.name] = index
+    index_manager.save_indices()
+
+    # Columns are unchanged, only size/mtime move on
+    schema_registry.get_schema(file_path)
+    return file_path
+
+
+def main(raw_csv, data_dir=DATA_DIR, ward_shp=WARD_SHP):
+    start_time = time.time()
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    index_manager = CSVIndexManager(data_dir)
+    schema_registry = CSVSchemaRegistry(data_dir)
+
+    # 1) Clean and drop crimes already ingested
+    df = clean_raw_month(raw_csv)
+    months = df['dt'].dt.to_period('M').unique()
+    if len(months) != 1:
+        raise ValueError(f"Expected exactly one month in {raw_csv}, found {sorted(map(str, months))}")
+    month = months[0]
+    seen = open_row_hashes(data_dir)
+    cleaned = len(df)
+    df = df[seen.filter_new(df, key='crime')].reset_index(drop=True)
+    print(f"[1] Cleaned {cleaned:,} burglaries for {month}, {len(df):,} not yet ingested")
+    if df.empty:
+        print(f"Nothing new to ingest for {month}")
+        return
+
+    # 2) Ward join
+    df = assign_wards(df, ward_shp)
+    print(f"[2] Assigned wards ({df['WD24CD'].notna().sum():,} matched)")
+
+    # 3) Rolling counts against the trailing months only
+    history = load_trailing_points(index_manager, schema_registry, month)
+    counts = count_recent_neighbours(df, history)
+    for col in counts.columns:
+        df[col] = counts[col].to_numpy()
+    print(f"[3] Counted neighbours against {len(history):,} incidents of the previous "
+          f"{max(WINDOWS_MONTHS)} months")
+
+    # 4) Append to the partitioned store and update index/schema in place
+    df['Month'] = month.to_timestamp().strftime('%Y-%m-%d')
+    df = df.drop(columns=['dt'])
+    file_path = append_month(df, month, index_manager, schema_registry)
+    # Only record the hashes once the rows are in the store
+    seen.save()
+    print(f"[4] Appended {len(df):,} rows to {file_path}")
+    print(f"Done in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('raw_csv', help="police.uk street-level CSV for the new month")
+    parser.add_argument('--data-dir', default=str(DATA_DIR))
+    parser.add_argument('--ward-shp', default=str(WARD_SHP))
+    args = parser.parse_args()
+    main(args.raw_csv, args.data_dir, args.ward_shp)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+kde_surface.py
+
+Monthly kernel density (KDE) surfaces of burglaries over London.
+
+Every month's incidents are binned onto a regular British National Grid
+raster (EPSG:27700) and smoothed with a Gaussian kernel by FFT convolution,
+so a smooth hotspot surface costs one FFT per month however many incidents
+there are. The kernel's transform is computed once and reused for every
+month.
+
+Surfaces are written to a single memory-mapped float32 .npy array
+(months x rows x cols, incidents per km^2) with a small JSON file holding
+the grid origin, cell size, bandwidth and month labels, so later stages can
+read single months or pixels without loading the whole stack.
+
+The surfaces are also sampled (bilinearly) at every London LSOA centroid,
+giving a kde_<bandwidth>m feature per LSOA x month that
+Build_features_table.py merges in when the file exists.
+
+Usage:
+    python kde_surface.py [--csv ...] [--bandwidth 500] [--cell-size 100]
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy import fft
+
+from spatial_counts import project_bng
+
+INPUT_CSV = "London_burglaries_with_wards_correct_with_price.csv"
+SHP_PATH = "LSOA_boundries/LSOA_2021_EW_BFE_V10.shp"
+OUTPUT_DIR = Path("outputs")
+
+BANDWIDTH_M = 500    # Gaussian kernel standard deviation
+CELL_SIZE_M = 100    # raster resolution
+
+# Kernel is truncated at this many bandwidths (and the raster padded by it)
+KERNEL_TRUNCATE = 4
+
+# Approx. London bounding box in degrees (same as map_to_graph.py)
+LONDON_BBOX = {'lon': (-0.5103, 0.3340), 'lat': (51.2868, 51.6919)}
+
+
+def kde_column(bandwidth_m):
+    """Feature column name for a bandwidth, e.g. kde_500m"""
+    return f"kde_{bandwidth_m:g}m"
+
+
+def surface_paths(outdir, bandwidth_m):
+    """(.npy surfaces, .json metadata) paths for a bandwidth"""
+    outdir = Path(outdir)
+    return outdir / f"kde_surfaces_{bandwidth_m:g}m.npy", outdir / f"kde_surfaces_{bandwidth_m:g}m.json"
+
+
+def gaussian_kernel(bandwidth_m, cell_size_m):
+    """Odd-sized 2D Gaussian kernel on the raster, normalised to sum to 1"""
+    radius = int(np.ceil(KERNEL_TRUNCATE * bandwidth_m / cell_size_m))
+    offsets = np.arange(-radius, radius + 1) * cell_size_m
+    profile = np.exp(-0.5 * (offsets / bandwidth_m) ** 2)
+    kernel = np.outer(profile, profile)
+    return kernel / kernel.sum()
+
+
+def build_kde_surfaces(x, y, months, outdir=OUTPUT_DIR, bandwidth_m=BANDWIDTH_M,
+                       cell_size_m=CELL_SIZE_M):
+    """
+    Build and store one KDE surface per month.
+
+    Args:
+        x, y: EPSG:27700 coordinates (metres) of the incidents
+        months: pandas Period (freq 'M') of each incident
+        outdir: Directory for the .npy / .json outputs
+        bandwidth_m: Gaussian kernel standard deviation in metres
+        cell_size_m: Raster cell size in metres
+
+    Returns:
+        (read-only memmap of shape (months, rows, cols), metadata dict)
+    """
+    surfaces_path, meta_path = surface_paths(outdir, bandwidth_m)
+    surfaces_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Raster covering all incidents, padded so the kernel never spills over the edge
+    kernel = gaussian_kernel(bandwidth_m, cell_size_m)
+    pad = kernel.shape[0] // 2 * cell_size_m
+    x0 = np.floor((x.min() - pad) / cell_size_m) * cell_size_m
+    y0 = np.floor((y.min() - pad) / cell_size_m) * cell_size_m
+    n_cols = int(np.ceil((x.max() + pad - x0) / cell_size_m)) + 1
+    n_rows = int(np.ceil((y.max() + pad - y0) / cell_size_m)) + 1
+    col = ((x - x0) // cell_size_m).astype(np.int64)
+    row = ((y - y0) // cell_size_m).astype(np.int64)
+
+    # Kernel transform once, padded to a fast FFT size for the full convolution
+    k = kernel.shape[0]
+    fft_shape = (fft.next_fast_len(n_rows + k - 1, real=True),
+                 fft.next_fast_len(n_cols + k - 1, real=True))
+    kernel_fft = fft.rfft2(kernel, s=fft_shape)
+    crop = k // 2
+    cell_area_km2 = (cell_size_m / 1000.0) ** 2
+
+    month_labels = pd.period_range(months.min(), months.max(), freq='M')
+    month_pos = pd.PeriodIndex(months).asi8 - month_labels[0].ordinal
+    order = np.argsort(month_pos, kind='stable')
+    bounds = np.searchsorted(month_pos[order], np.arange(len(month_labels) + 1))
+
+    surfaces = np.lib.format.open_memmap(
+        surfaces_path, mode='w+', dtype=np.float32,
+        shape=(len(month_labels), n_rows, n_cols)
+    )
+    for m in range(len(month_labels)):
+        idx = order[bounds[m]:bounds[m + 1]]
+        counts = np.bincount(row[idx] * n_cols + col[idx], minlength=n_rows * n_cols)
+        smoothed = fft.irfft2(fft.rfft2(counts.reshape(n_rows, n_cols), s=fft_shape) * kernel_fft,
+                              s=fft_shape)
+        # Tiny negative values are FFT round-off
+        surfaces[m] = np.maximum(smoothed[crop:crop + n_rows, crop:crop + n_cols], 0) / cell_area_km2
+    surfaces.flush()
+    del surfaces
+
+    meta = {
+        'x0': float(x0), 'y0': float(y0),
+        'cell_size_m': cell_size_m, 'bandwidth_m': bandwidth_m,
+        'rows': n_rows, 'cols': n_cols,
+        'months': [str(month) for month in month_labels]
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return load_kde_surfaces(outdir, bandwidth_m)
+
+
+def load_kde_surfaces(outdir=OUTPUT_DIR, bandwidth_m=BANDWIDTH_M):
+    """Memory-map stored surfaces; returns (surfaces, metadata)"""
+    surfaces_path, meta_path = surface_paths(outdir, bandwidth_m)
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    return np.load(surfaces_path, mmap_mode='r'), meta
+
+
+def sample_surfaces(surfaces, meta, x, y):
+    """
+    Bilinear samples of every month's surface at EPSG:27700 points.
+
+    Returns:
+        float32 array of shape (months, points)
+    """
+    cell = meta['cell_size_m']
+    # Positions relative to cell centres
+    fx = np.clip((np.asarray(x) - meta['x0']) / cell - 0.5, 0, meta['cols'] - 1)
+    fy = np.clip((np.asarray(y) - meta['y0']) / cell - 0.5, 0, meta['rows'] - 1)
+    c0 = np.minimum(np.floor(fx).astype(np.int64), meta['cols'] - 2)
+    r0 = np.minimum(np.floor(fy).astype(np.int64), meta['rows'] - 2)
+    wx, wy = (fx - c0).astype(np.float32), (fy - r0).astype(np.float32)
+
+    return ((1 - wy) * ((1 - wx) * surfaces[:, r0, c0] + wx * surfaces[:, r0, c0 + 1]) +
+            wy * ((1 - wx) * surfaces[:, r0 + 1, c0] + wx * surfaces[:, r0 + 1, c0 + 1]))
+
+
+def london_lsoa_centroids(shp_path=SHP_PATH):
+    """LSOA codes and EPSG:27700 centroids (from the LAT/LONG attributes) inside the London box"""
+    lsoas = gpd.read_file(shp_path, columns=['LSOA21CD', 'LAT', 'LONG'], ignore_geometry=True)
+    lsoas = lsoas[
+        lsoas['LONG'].between(*LONDON_BBOX['lon']) & lsoas['LAT'].between(*LONDON_BBOX['lat'])
+    ].reset_index(drop=True)
+    xy = project_bng(lsoas['LAT'].to_numpy(), lsoas['LONG'].to_numpy())
+    return lsoas['LSOA21CD'].to_numpy(), xy[:, 0], xy[:, 1]
+
+
+def lsoa_kde_table(surfaces, meta, codes, x, y):
+    """Long LSOA x month table of sampled densities"""
+    samples = sample_surfaces(surfaces, meta, x, y)
+    return pd.DataFrame({
+        'LSOA code': np.tile(codes, len(meta['months'])),
+        'month': np.repeat(meta['months'], len(codes)),
+        kde_column(meta['bandwidth_m']): samples.ravel()
+    })
+
+
+def main(csv_path=INPUT_CSV, shp_path=SHP_PATH, outdir=OUTPUT_DIR,
+         bandwidth_m=BANDWIDTH_M, cell_size_m=CELL_SIZE_M):
+    start_time = time.time()
+    outdir = Path(outdir)
+
+    df = pd.read_csv(csv_path, usecols=['Month', 'longitude', 'latitude'], low_memory=False)
+    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
+    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
+    df['month'] = pd.to_datetime(df['Month'], errors='coerce').dt.to_period('M')
+    df = df.dropna(subset=['longitude', 'latitude', 'month'])
+    df = df[df['longitude'].between(*LONDON_BBOX['lon']) & df['latitude'].between(*LONDON_BBOX['lat'])]
+    print(f"[1] Loaded {len(df):,} incidents")
+
+    xy = project_bng(df['latitude'].to_numpy(), df['longitude'].to_numpy())
+    surfaces, meta = build_kde_surfaces(
+        xy[:, 0], xy[:, 1], pd.PeriodIndex(df['month']), outdir, bandwidth_m, cell_size_m
+    )
+    print(f"[2] Built {len(meta['months'])} surfaces of {meta['rows']} x {meta['cols']} cells "
+          f"({cell_size_m} m cells, {bandwidth_m} m bandwidth) in {surface_paths(outdir, bandwidth_m)[0]}")
+
+    codes, x, y = london_lsoa_centroids(shp_path)
+    table = lsoa_kde_table(surfaces, meta, codes, x, y)
+    out_csv = outdir / f"lsoa_{kde_column(bandwidth_m)}.csv"
+    table.to_csv(out_csv, index=False)
+    print(f"[3] Sampled {len(codes):,} LSOA centroids, saved to {out_csv}")
+    print(f"Done in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', default=INPUT_CSV)
+    parser.add_argument('--shp', default=SHP_PATH)
+    parser.add_argument('--outdir', default=str(OUTPUT_DIR))
+    parser.add_argument('--bandwidth', type=float, default=BANDWIDTH_M, help="kernel bandwidth in metres")
+    parser.add_argument('--cell-size', type=float, default=CELL_SIZE_M, help="raster cell size in metres")
+    args = parser.parse_args()
+    main(args.csv, args.shp, args.outdir, args.bandwidth, args.cell_size)
@@ -0,0 +1,180 @@
+"""
+lsoa_dimension.py
+
+Prebuilt LSOA dimension table: the static covariates Build_features_table.py
+attaches to every LSOA, one row per LSOA code:
+  - LSOA21NM and whether the LSOA intersects the Greater London bbox
+    (from the LSOA boundary shapefile)
+  - IMD Rank London / IMD Decile London (N195.csv; blanks -> 0)
+  - Population <year>, PopulationPerSqKm <year> and AreaSqKm (Popdense.xlsx)
+
+Reading the full England shapefile, parsing N195.csv with the python engine
+and Popdense.xlsx through openpyxl dominate the static part of a feature
+build, so the table is cached in data/lsoa_dimension.npz together with the
+size and mtime of its sources and rebuilt only when one of them changes.
+
+The feature build joins it by integer LSOA id (area_codes.py) with a single
+gather: LsoaDimension.rows() gives the table row of every id.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+DEFAULT_CACHE = Path(__file__).resolve().parent / "data" / "lsoa_dimension.npz"
+
+# Greater London bounding box in WGS84 (lon_min, lat_min, lon_max, lat_max)
+LONDON_BOX = (-0.5103, 51.2868, 0.3340, 51.6919)
+
+IMD_COLUMNS = ['IMD Rank London', 'IMD Decile London']
+
+
+def _source_signature(paths):
+    """Size and mtime of every source file (shapefile components included)"""
+    signature = {}
+    for path in map(Path, paths):
+        parts = [path.with_suffix(s) for s in ('.shp', '.shx', '.dbf')] if path.suffix == '.shp' else [path]
+        for part in parts:
+            if part.exists():
+                stats = os.stat(part)
+                signature[str(part.resolve())] = [stats.st_size, stats.st_mtime]
+    return signature
+
+
+def _read_boundaries(shp_path):
+    """LSOA21NM and London-bbox flag per LSOA21CD"""
+    # full UK LSOA shapefile in British National Grid
+    gdf = gpd.read_file(shp_path).to_crs(epsg=27700)
+    london_box = (
+        gpd.GeoSeries([box(*LONDON_BOX)], crs="EPSG:4326")
+           .to_crs(epsg=27700)
+           .iloc[0]
+    )
+    boundaries = pd.DataFrame({
+        'LSOA21NM': gdf['LSOA21NM'] if 'LSOA21NM' in gdf else None,
+        'in_london': gdf.geometry.intersects(london_box)
+    }).set_index(gdf['LSOA21CD'])
+    return boundaries[~boundaries.index.duplicated()]
+
+
+def _read_imd(n195_path):
+    """IMD rank / decile per LSOA code (first row per code)"""
+    imd = (
+        pd.read_csv(
+            n195_path,
+            engine="python",        # tolerant parser
+            on_bad_lines="skip",    # drop footer rows with too many commas
+            dtype=str               # keep raw strings for now
+        )
+        .rename(columns=lambda c: c.strip())  # trim stray spaces in headers
+    )
+    imd = imd[['LSOA code', *IMD_COLUMNS]].dropna(subset=['LSOA code']).drop_duplicates('LSOA code')
+    # make the two metrics numeric; blanks → 0
+    for c in IMD_COLUMNS:
+        imd[c] = pd.to_numeric(imd[c], errors='coerce').fillna(0)
+    return imd.set_index('LSOA code')
+
+
+def _read_population(pop_path):
+    """Population and density per year, and area, per LSOA code"""
+    pop = (
+        pd.read_excel(pop_path, dtype={'LSOA 2021 Code': str})
+        .rename(columns=lambda c: c.strip())          # trim header spaces
+        .dropna(subset=['LSOA 2021 Code'])            # guard against blank rows
+        .drop_duplicates('LSOA 2021 Code')
+        .set_index('LSOA 2021 Code')
+    )
+    # yearly columns that have both a population and a density value
+    pop_years = {int(re.search(r'(\d{4})', c).group(1)): c for c in pop.columns if c.endswith("Pop")}
+    dens_years = {int(re.search(r'(\d{4})', c).group(1)): c for c in pop.columns if c.endswith("PpSqKm")}
+    columns = {'AreaSqKm': pd.to_numeric(pop['AreaSqKm'], errors='coerce')}
+    for year in sorted(set(pop_years) & set(dens_years)):
+        columns[f'Population {year}'] = pd.to_numeric(pop[pop_years[year]], errors='coerce')
+        columns[f'PopulationPerSqKm {year}'] = pd.to_numeric(pop[dens_years[year]], errors='coerce')
+    return pd.DataFrame(columns)
+
+
+class LsoaDimension:
+    """Static covariates per LSOA code, cached until a source file changes"""
+
+    def __init__(self, shp_path, n195_path, pop_path, cache_file=DEFAULT_CACHE):
+        self.cache_file = Path(cache_file)
+        key = {'source': _source_signature([shp_path, n195_path, pop_path])}
+        if not self._load_cache(key):
+            print("Building LSOA dimension table...")
+            self._build(shp_path, n195_path, pop_path)
+            self._save_cache(key)
+
+    def _build(self, shp_path, n195_path, pop_path):
+        boundaries = _read_boundaries(shp_path)
+        table = pd.concat([_read_imd(n195_path), _read_population(pop_path)], axis=1)
+        codes = boundaries.index.union(table.index)
+        self.codes = codes.to_numpy(dtype=str)
+        self.names = boundaries['LSOA21NM'].reindex(codes).fillna('').to_numpy(dtype=str)
+        self.in_london = boundaries['in_london'].reindex(codes, fill_value=False).to_numpy(dtype=bool)
+        self.columns = table.columns.to_numpy(dtype=str)
+        self.values = table.reindex(codes).to_numpy(dtype=float)
+
+    def _load_cache(self, key):
+        """Load the table if it was built from the same source files"""
+        if not self.cache_file.exists():
+            return False
+        try:
+            with np.load(self.cache_file) as cached:
+                if json.loads(str(cached['key'])) != json.loads(json.dumps(key)):
+                    return False
+                self.codes = cached['codes']
+                self.names = cached['names']
+                self.in_london = cached['in_london']
+                self.columns = cached['columns']
+                self.values = cached['values']
+            return True
+        except Exception as e:
+            print(f"Could not load LSOA dimension cache {self.cache_file}: {e}")
+            return False
+
+    def _save_cache(self, key):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            self.cache_file,
+            key=np.array(json.dumps(key)),
+            codes=self.codes,
+            names=self.names,
+            in_london=self.in_london,
+            columns=self.columns,
+            values=self.values
+        )
+
+    @property
+    def years(self):
+        """Years with population and density values"""
+        return sorted(int(c.split()[-1]) for c in self.columns if c.startswith('Population '))
+
+    def rows(self, area_codes, lsoa_ids):
+        """
+        Table row of every LSOA id; len(self.codes) (the missing row) for
+        LSOAs not in the table and for MISSING_ID
+        """
+        table_ids = area_codes.encode('LSOA', self.codes, add_missing=False)
+        known = table_ids >= 0
+        # id -> row lookup; its last slot is never a table row, so MISSING_ID
+        # (-1) lands on the missing row as well
+        lookup = np.full(max(table_ids.max(initial=-1), np.max(lsoa_ids, initial=-1)) + 2, len(self.codes))
+        lookup[table_ids[known]] = np.flatnonzero(known)
+        return lookup[lsoa_ids]
+
+    def gather(self, rows, columns):
+        """Values of `columns` at the given table rows (NaN on the missing row)"""
+        positions = [self.columns.tolist().index(c) for c in columns]
+        values = np.vstack([self.values[:, positions], np.full(len(positions), np.nan)])
+        return values[rows]
+
+    def london(self, rows):
+        """Whether the LSOAs at the given table rows intersect the London bbox"""
+        return np.append(self.in_london, False)[rows]
@@ -0,0 +1,165 @@
+"""
+lsoa_graph.py
+
+LSOA contiguity graph, built once per boundary shapefile.
+
+Two LSOAs are neighbours when their polygons touch: in any boundary point
+('queen', as the original per-polygon loops did) or along a boundary
+segment ('rook'). All touching pairs come from one bulk spatial-index query
+    gdf.sindex.query(gdf.geometry, predicate="touches")
+instead of a geom.touches() call per bounding-box candidate.
+
+The graph of the whole shapefile is cached in data/ as its edge index
+(<key>_edges.npy, 2 x E, both directions) and the LSOA code of every node
+(<key>_codes.npy); the key is a hash of the shapefile contents, so later
+runs only load the two arrays. Consumers take the subgraph of the LSOAs
+they use, which keeps the shapefile order:
+    graph = LsoaGraph.from_shapefile(shp_path).subgraph(codes)
+    graph.edge_index        # (2, E) int64, for PyG and SpatialLag
+    graph.to_networkx()     # nodes 0..n-1 with an lsoa_code attribute
+
+A graph is saved as one .npz (int32 COO edge index + codes) that consumers
+load straight into an edge_index tensor, without building a networkx graph:
+    graph.save("london_lsoa_graph.npz")
+    edge_index = torch.from_numpy(LsoaGraph.load("london_lsoa_graph.npz").edge_index)
+GEXF (write_gexf) is only an export for tools such as Gephi.
+
+Run directly to build the cache ahead of training:
+    python lsoa_graph.py --shp LSOA_boundries/LSOA_2021_EW_BFE_V10.shp
+"""
+
+import argparse
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+SHP_PATH = "LSOA_boundries/LSOA_2021_EW_BFE_V10.shp"
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / "data"
+
+# DE-9IM pattern of polygons that touch along a line, not only at a point
+ROOK_PATTERN = 'F***1****'
+
+
+def _shapefile_hash(shp_path):
+    """SHA-1 of the geometry, attribute and projection files"""
+    digest = hashlib.sha1()
+    shp_path = Path(shp_path)
+    for suffix in ('.shp', '.dbf', '.prj'):
+        part = shp_path.with_suffix(suffix)
+        if part.exists():
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def contiguity_edges(geometry, contiguity='queen'):
+    """
+    Edge index of touching polygons.
+
+    Args:
+        geometry: GeoSeries; node i is its i-th polygon
+        contiguity: 'queen' (any shared boundary point) or 'rook' (a shared
+            boundary segment)
+
+    Returns:
+        (2, E) int64 array with both directions of every edge, sorted
+    """
+    if contiguity not in ('queen', 'rook'):
+        raise ValueError(f"Unknown contiguity {contiguity!r}; use 'queen' or 'rook'")
+    geometry = gpd.GeoSeries(geometry).reset_index(drop=True)
+    src, dst = geometry.sindex.query(geometry, predicate='touches')
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    if contiguity == 'rook':
+        geoms = geometry.to_numpy()
+        shared_edge = shapely.relate_pattern(geoms[src], geoms[dst], ROOK_PATTERN)
+        src, dst = src[shared_edge], dst[shared_edge]
+    order = np.lexsort((dst, src))
+    return np.vstack([src[order], dst[order]]).astype(np.int64)
+
+
+class LsoaGraph:
+    """LSOA codes (one per node) and the contiguity edge index between them"""
+
+    def __init__(self, codes, edge_index):
+        self.codes = np.asarray(codes, dtype=str)
+        self.edge_index = np.ascontiguousarray(edge_index, dtype=np.int64).reshape(2, -1)
+
+    @classmethod
+    def from_shapefile(cls, shp_path=SHP_PATH, contiguity='queen', cache_dir=DEFAULT_CACHE_DIR):
+        """Graph of every LSOA in the shapefile, from the cache if it is current"""
+        key = f"lsoa_graph_{_shapefile_hash(shp_path)[:16]}_{contiguity}"
+        edges_file = Path(cache_dir) / f"{key}_edges.npy"
+        codes_file = Path(cache_dir) / f"{key}_codes.npy"
+        if edges_file.exists() and codes_file.exists():
+            try:
+                return cls(np.load(codes_file), np.load(edges_file))
+            except Exception as e:
+                print(f"Could not load LSOA graph cache {edges_file}: {e}")
+
+        print(f"Building {contiguity} contiguity graph from {shp_path}...")
+        # same projection as the original loops, so touching is judged on the same coordinates
+        gdf = gpd.read_file(shp_path).to_crs(epsg=27700)
+        graph = cls(gdf['LSOA21CD'].to_numpy(dtype=str), contiguity_edges(gdf.geometry, contiguity))
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        np.save(edges_file, graph.edge_index)
+        np.save(codes_file, graph.codes)
+        print(f"Cached {graph.n_nodes} nodes and {graph.n_edges} edges in {edges_file.parent}")
+        return graph
+
+    @property
+    def n_nodes(self):
+        return len(self.codes)
+
+    @property
+    def n_edges(self):
+        """Number of undirected edges"""
+        return self.edge_index.shape[1] // 2
+
+    def subgraph(self, codes):
+        """Graph of the LSOAs in `codes`, renumbered in this graph's node order"""
+        keep = pd.Index(self.codes).isin(pd.Index(codes))
+        node = np.full(self.n_nodes, -1, dtype=np.int64)
+        node[keep] = np.arange(keep.sum())
+        src, dst = node[self.edge_index]
+        both = (src >= 0) & (dst >= 0)
+        return LsoaGraph(self.codes[keep], np.vstack([src[both], dst[both]]))
+
+    def save(self, path):
+        """Edge index (int32 COO) and codes as one .npz"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, edge_index=self.edge_index.astype(np.int32), codes=self.codes)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as npz:
+            return cls(npz['codes'], npz['edge_index'])
+
+    def to_networkx(self):
+        """Undirected networkx graph, nodes 0..n-1 with their lsoa_code"""
+        # only the networkx consumers (map_to_graph.py, the GEXF export) need it
+        import networkx as nx
+        G = nx.Graph()
+        G.add_nodes_from((i, {'lsoa_code': code}) for i, code in enumerate(self.codes.tolist()))
+        G.add_edges_from(self.edge_index.T.tolist())
+        return G
+
+    def write_gexf(self, path):
+        """Optional GEXF export (nodes 0..n-1 with their lsoa_code)"""
+        import networkx as nx
+        nx.write_gexf(self.to_networkx(), path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shp', default=SHP_PATH)
+    parser.add_argument('--contiguity', choices=['queen', 'rook'], default='queen')
+    args = parser.parse_args()
+    graph = LsoaGraph.from_shapefile(args.shp, args.contiguity)
+    print(f"{graph.n_nodes} LSOAs, {graph.n_edges} {args.contiguity} contiguity edges")
@@ -2,6 +2,10 @@ import geopandas as gpd
 import networkx as nx
 import matplotlib.pyplot as plt
 
+from lsoa_graph import LsoaGraph
+
+WRITE_GEXF = False
+
 # 1. Load your LSOA file (still in WGS84, so LAT/LONG are valid)
 shp_path = r"C:\Coding\CBL-London-Crime-\LSOA_boundries\LSOA_2021_EW_BFE_V10.shp"
 gdf = gpd.read_file(shp_path)
@@ -22,27 +26,11 @@ print(f"Kept {len(london)} LSOAs in the London box (out of {len(gdf)})")
 # 3) Re-project
 london = london.to_crs(epsg=27700)
 
-# 4) Spatial index & adjacency
-sindex = london.sindex
-adjacency = {}
-for idx, geom in london.geometry.items():       # idx == 0…n-1 now
-    candidates = list(sindex.intersection(geom.bounds))
-    adjacency[idx] = [
-        j for j in candidates
-        if j != idx
-           and geom.touches(london.geometry.iloc[j])  # use iloc to be safe
-    ]
-
-
-# 5. Build the graph
-G = nx.Graph()
-for idx, row in london.iterrows():
-    G.add_node(idx, lsoa_code=row["LSOA21CD"])
-for idx, neighs in adjacency.items():
-    for nbr in neighs:
-        G.add_edge(idx, nbr)
-
-# 6. (Optional) Plot for sanity check
+# 4) Contiguity graph of the kept LSOAs (cached per shapefile, see lsoa_graph.py)
+graph = LsoaGraph.from_shapefile(shp_path).subgraph(london["LSOA21CD"])
+G = graph.to_networkx()
+
+# 5. (Optional) Plot for sanity check
 pos = {i: geom.centroid.coords[0] for i, geom in london.geometry.items()}
 fig, ax = plt.subplots(1,1,figsize=(6,6))
 london.plot(ax=ax, color="lightgray", edgecolor="white")
@@ -51,6 +39,8 @@ nx.draw_networkx_nodes(G, pos, ax=ax, node_size=5, node_color="blue")
 ax.set_axis_off()
 plt.show()
 
-# 7. Save
-nx.write_gexf(G, "london_lsoa_graph.gexf")
+# 6. Save the edge index + LSOA codes; GEXF only for tools that need it (e.g. Gephi)
+graph.save("london_lsoa_graph.npz")
+if WRITE_GEXF:
+    graph.write_gexf("london_lsoa_graph.gexf")
 print("Graph saved.")
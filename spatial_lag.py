@@ -0,0 +1,91 @@
+"""
+spatial_lag.py
+
+Spatial-lag features over the LSOA contiguity graph.
+
+The graph is turned once into a sparse adjacency matrix A (scipy CSR,
+A[i, j] = 1 when LSOA j neighbours LSOA i) and its row-normalized version W.
+With a feature laid out as an LSOA x month matrix X, the lag of every LSOA
+in every month is a single sparse-dense product:
+    neighbour sum  = A @ X
+    neighbour mean = W @ X        (0 for LSOAs without neighbours)
+    neighbour max  = max of X over each CSR row's neighbours
+Neighbours without a value in a month count as 0.
+
+SpatialLag.table() does the pivot for long LSOA x month tables, e.g. the
+feature store or the GCN feature CSV:
+    lag = SpatialLag.from_edge_index(edge_index, len(codes))
+    df = read_features(['LSOA code', 'month', 'crime_count_lag1', 'roll_mean_6m'])
+    nbr = lag.table(df, codes, ['crime_count_lag1', 'roll_mean_6m'], stats=('mean', 'max'))
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+STATS = ('mean', 'max', 'sum')
+
+
+class SpatialLag:
+    """Neighbour sum / mean / max of LSOA x month matrices"""
+
+    def __init__(self, adjacency):
+        self.adjacency = sparse.csr_matrix(adjacency, dtype=float)
+        self.adjacency.sum_duplicates()
+        self.adjacency.data[:] = 1.0
+        degree = np.diff(self.adjacency.indptr)
+        self.n_nodes = self.adjacency.shape[0]
+        self.weights = (sparse.diags(1.0 / np.maximum(degree, 1)) @ self.adjacency).tocsr()
+        self._nonempty = degree > 0
+
+    @classmethod
+    def from_edge_index(cls, edge_index, n_nodes):
+        """From a 2 x E array of (source, target) node pairs (both directions)"""
+        edge_index = np.asarray(edge_index)
+        adjacency = sparse.csr_matrix(
+            (np.ones(edge_index.shape[1]), (edge_index[0], edge_index[1])),
+            shape=(n_nodes, n_nodes)
+        )
+        return cls(adjacency)
+
+    def sum(self, X):
+        return self.adjacency @ X
+
+    def mean(self, X):
+        return self.weights @ X
+
+    def max(self, X):
+        X = np.asarray(X, dtype=float)
+        out = np.zeros((self.n_nodes,) + X.shape[1:])
+        if self.adjacency.nnz:
+            starts = self.adjacency.indptr[:-1][self._nonempty]
+            out[self._nonempty] = np.maximum.reduceat(X[self.adjacency.indices], starts, axis=0)
+        return out
+
+    def table(self, df, codes, columns, stats=('mean',), code_col='LSOA code', month_col='month'):
+        """
+        Spatial lags of long-table columns (one row per LSOA and month).
+
+        Args:
+            codes: LSOA code of every graph node; rows of other LSOAs get 0
+            stats: any of STATS
+
+        Returns:
+            DataFrame of nbr_<stat>_<column> columns on df's index
+        """
+        node = pd.Index(codes).get_indexer(df[code_col])
+        month_pos, months = pd.factorize(df[month_col])
+        in_graph = node >= 0
+        # First row per LSOA and month, as drop_duplicates would keep
+        first = in_graph & ~pd.Series(node * len(months) + month_pos).duplicated().to_numpy()
+
+        out = pd.DataFrame(index=df.index)
+        for c in columns:
+            X = np.zeros((self.n_nodes, len(months)))
+            X[node[first], month_pos[first]] = df[c].to_numpy(dtype=float)[first]
+            for stat in stats:
+                lagged = getattr(self, stat)(X)
+                values = np.zeros(len(df))
+                values[in_graph] = lagged[node[in_graph], month_pos[in_graph]]
+                out[f'nbr_{stat}_{c}'] = values
+        return out
@@ -3,62 +3,133 @@ import os
 from pathlib import Path
 import time
 
-def main():
-    # Path configurations
-    input_file = 'London_burglaries_with_wards_correct_with_price.csv'
-    output_dir = Path('data/yearly_burglaries')
-    
+from ProjectDashboard.backend.optimized_csv import CSVIndexManager, CSVSchemaRegistry
+
+# Buffer size of each open yearly writer
+WRITE_BUFFER_BYTES = 8 * 1024 * 1024
+
+
+class YearlyPartitionWriter:
+    """
+    One open, buffered writer per yearly file.
+
+    Rows are written month by month, so while writing we already know the
+    byte range each month occupies, how many rows each file holds and where
+    the header ends - everything CSVIndexManager would otherwise have to
+    rescan the files for.
+    """
+
+    def __init__(self, output_dir, columns, file_prefix="london_burglaries"):
+        self.output_dir = Path(output_dir)
+        self.file_prefix = file_prefix
+        self.header = pd.DataFrame(columns=columns).to_csv(index=False, lineterminator='\n').encode('utf-8')
+        self.files = {}
+
+    def _open(self, year):
+        output_file = self.output_dir / f"{self.file_prefix}_{year}.csv"
+        handle = open(output_file, 'wb', buffering=WRITE_BUFFER_BYTES)
+        handle.write(self.header)
+        self.files[year] = {
+            'path': output_file,
+            'handle': handle,
+            'pos': len(self.header),
+            'rows': 0,
+            'month_offsets': {},
+            'last_month': None
+        }
+        return self.files[year]
+
+    def write(self, year, month, rows):
+        """Append rows of a single month to the yearly file"""
+        state = self.files.get(year) or self._open(year)
+        data = rows.to_csv(header=False, index=False, lineterminator='\n').encode('utf-8')
+        state['handle'].write(data)
+
+        start, end = state['pos'], state['pos'] + len(data)
+        ranges = state['month_offsets'].setdefault(month, [])
+        if state['last_month'] == month and ranges and ranges[-1][1] == start:
+            # Same month as the previous block: extend its range
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+        state['pos'] = end
+        state['rows'] += len(rows)
+        state['last_month'] = month
+
+    def close(self):
+        """Close every file and return their index entries keyed by file name"""
+        indices = {}
+        for year, state in sorted(self.files.items()):
+            state['handle'].close()
+            file_stats = os.stat(state['path'])
+            months = sorted(state['month_offsets'])
+            indices[state['path'].name] = {
+                'size_bytes': file_stats.st_size,
+                'modified_time': file_stats.st_mtime,
+                'first_month': months[0],
+                'last_month': months[-1],
+                'months': months,
+                'header_end': len(self.header),
+                'month_offsets': state['month_offsets'],
+                'row_count': state['rows']
+            }
+        return indices
+
+
+def main(input_file='London_burglaries_with_wards_correct_with_price.csv',
+         output_dir='data/yearly_burglaries'):
+    output_dir = Path(output_dir)
+
     # Create output directory if it doesn't exist
     output_dir.mkdir(exist_ok=True, parents=True)
-    
+
     print(f"Starting to process {input_file}...")
     start_time = time.time()
-    
+
     # Read the CSV file with optimized parameters
     # Using chunksize to handle large file in memory-efficient way
     chunk_size = 500000  # Process half a million rows at a time
-    
+
+    writer = None
     for i, chunk in enumerate(pd.read_csv(input_file, parse_dates=['Month'], chunksize=chunk_size)):
         print(f"Processing chunk {i+1}...")
-        
-        # Extract year from Month column
-        chunk['Year'] = pd.to_datetime(chunk['Month']).dt.year
-        
-        # Group by year and save each group to a separate file
-        for year, year_data in chunk.groupby('Year'):
-            # Remove the Year column since it's redundant with Month
-            year_data = year_data.drop(columns=['Year'])
-            
-            # Define output filename
-            output_file = output_dir / f"london_burglaries_{year}.csv"
-            
-            # If file already exists, append without header
-            if output_file.exists():
-                year_data.to_csv(output_file, mode='a', header=False, index=False)
-            else:
-                year_data.to_csv(output_file, index=False)
-    
-    # Verify all files were created
-    created_files = list(output_dir.glob('london_burglaries_*.csv'))
-    created_files.sort()
-    
+
+        if writer is None:
+            writer = YearlyPartitionWriter(output_dir, chunk.columns)
+
+        # Group by month (in order) so each yearly file is written month by month
+        month_keys = chunk['Month'].dt.strftime('%Y-%m')
+        for month, month_data in chunk.groupby(month_keys, sort=True):
+            writer.write(int(month[:4]), month, month_data)
+
+    if writer is None:
+        print("No rows found, nothing written")
+        return
+
+    # The writers collected everything the index needs during the single pass
+    indices = writer.close()
+    index_manager = CSVIndexManager(output_dir)
+    index_manager.indices.update(indices)
+    index_manager.save_indices()
+
+    # Register the (shared) schema of the new files as well
+    schema_registry = CSVSchemaRegistry(output_dir)
+    for file_name in indices:
+        schema_registry.get_schema(output_dir / file_name)
+
     print(f"\nProcess completed in {time.time() - start_time:.2f} seconds")
-    print(f"Created {len(created_files)} files:")
-    
+    print(f"Created {len(indices)} files, index saved to {index_manager.index_file}:")
+
     # Show file details
     total_size = 0
-    for file_path in created_files:
-        file_size = file_path.stat().st_size / (1024 * 1024)  # Size in MB
+    for file_name, index in indices.items():
+        file_size = index['size_bytes'] / (1024 * 1024)  # Size in MB
         total_size += file_size
-        
-        # Count rows in each file
-        with open(file_path, 'r') as f:
-            row_count = sum(1 for _ in f) - 1  # Subtract 1 for header
-        
-        print(f"  {file_path.name}: {file_size:.2f} MB, {row_count:,} records")
-    
+        print(f"  {file_name}: {file_size:.2f} MB, {index['row_count']:,} records")
+
     print(f"\nTotal size of split files: {total_size:.2f} MB")
     print(f"Original file size: {Path(input_file).stat().st_size / (1024 * 1024):.2f} MB")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
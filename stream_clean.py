@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+stream_clean.py
+
+Streaming, bounded-memory cleaner for the raw police.uk street-level export.
+Replaces the quick_clean.py / Additional_process.py / Additonal_process_pt2.py
+chain, which each load the full CSV (one of them as str for every column)
+and write a full copy for the next script to read again.
+
+The raw file is read in chunks with fixed (string) dtypes and every chunk
+goes through one fused pass:
+  1. drop stray header rows and "Unnamed" columns, strip column names
+  2. keep burglaries only (before any other string work)
+  3. strip whitespace in the remaining string values
+  4. coerce coordinates and parse the YYYY-MM month
+  5. keep rows inside the London bounding box
+  6. drop exact duplicates, across chunks, via 64-bit row hashes (dedup.py)
+  7. lay the columns out (see LAYOUTS)
+and is written straight into yearly partitions (one file per year, written
+month by month), with the byte-range month index that optimized_csv.py
+reads. Memory is bounded by the chunk size plus 8 bytes per kept row for
+the dedup hashes; with --hash-dir the hashes spill to disk beyond
+dedup.MAX_MEMORY_HASHES and persist, so a backfill split over several raw
+files (e.g. one per year) is deduplicated across all of them.
+
+Layouts:
+  - "quick": the quick_clean.py columns (original names plus longitude,
+    latitude and dt), as read by crimes_to_wards.py
+  - "normalized": the Additional_process.py + Additonal_process_pt2.py
+    columns (snake_case names, crime_id / year / month first, context last)
+
+Usage:
+    python stream_clean.py raw.csv [--out-dir data/cleaned] [--layout quick]
+                                   [--dedup-key row] [--hash-dir ...]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from dedup import DEDUP_KEYS, RowHashSet
+from ProjectDashboard.backend.optimized_csv import CSVIndexManager
+from split_burglaries_by_year import YearlyPartitionWriter
+
+OUTPUT_DIR = Path("data/cleaned")
+FILE_PREFIX = "burglaries_cleaned"
+CHUNK_SIZE = 500_000
+
+LAYOUTS = ("quick", "normalized")
+
+# Same bounds as Additional_process.py
+LON_RANGE = (-0.51, 0.33)
+LAT_RANGE = (51.29, 51.69)
+
+
+def clean_chunk(chunk):
+    """Steps 1-5 on one raw chunk (all columns read as str)"""
+    chunk = chunk.loc[:, ~chunk.columns.str.contains(r"^Unnamed")]
+    chunk.columns = chunk.columns.str.strip()
+
+    # Stray header rows repeat the column names
+    chunk = chunk[chunk['Month'].str.strip().str.lower() != 'month']
+    chunk = chunk[chunk['Crime type'].str.strip().str.lower() == 'burglary']
+
+    chunk = chunk.apply(lambda col: col.str.strip())
+
+    chunk = chunk.assign(
+        longitude=pd.to_numeric(chunk['Longitude'], errors='coerce'),
+        latitude=pd.to_numeric(chunk['Latitude'], errors='coerce'),
+        dt=pd.to_datetime(chunk['Month'], format='%Y-%m', errors='coerce')
+    )
+    return chunk[
+        chunk['dt'].notna() &
+        chunk['longitude'].between(*LON_RANGE) &
+        chunk['latitude'].between(*LAT_RANGE)
+    ]
+
+
+def apply_layout(chunk, layout):
+    """Output columns of a cleaned chunk"""
+    if layout == "quick":
+        return chunk
+    # Additional_process.py: snake_case names, year/month instead of the
+    # month string, coordinates as parsed, unknown outcomes filled in
+    df = chunk.drop(columns=['Longitude', 'Latitude', 'Month'])
+    df.columns = df.columns.str.lower().str.replace(" ", "_")
+    df = df.assign(year=df['dt'].dt.year, month=df['dt'].dt.month).drop(columns=['dt'])
+    if 'last_outcome_category' in df:
+        df['last_outcome_category'] = df['last_outcome_category'].fillna('Unknown')
+    if 'context' not in df:
+        df['context'] = ''
+    core = ['crime_id', 'year', 'month']
+    others = [col for col in df.columns if col not in core and col != 'context']
+    return df[core + others + ['context']]
+
+
+def stream_clean(in_csv, out_dir=OUTPUT_DIR, layout="quick", chunk_size=CHUNK_SIZE,
+                 dedup_key='row', hash_dir=None):
+    """
+    Clean a raw export chunk by chunk into yearly partitions of out_dir.
+
+    Rows are deduplicated on dedup_key ('row': the whole cleaned row,
+    'crime': Crime ID + coordinates + month). With hash_dir the hashes of
+    earlier runs are loaded from and saved back to that directory.
+
+    Returns:
+        Index entries of the written files, keyed by file name
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    writer = None
+    seen = RowHashSet(hash_dir)
+    rows_in = rows_out = 0
+    reader = pd.read_csv(in_csv, dtype=str, na_values=["", " "], chunksize=chunk_size)
+    for i, raw in enumerate(reader):
+        rows_in += len(raw)
+        chunk = clean_chunk(raw)
+        chunk = chunk[seen.filter_new(chunk, dedup_key)]
+        out = apply_layout(chunk, layout)
+
+        if writer is None:
+            writer = YearlyPartitionWriter(out_dir, out.columns, file_prefix=FILE_PREFIX)
+        for month, rows in out.groupby(chunk['dt'].dt.strftime('%Y-%m'), sort=True):
+            writer.write(int(month[:4]), month, rows)
+        rows_out += len(out)
+        print(f"[{i + 1}] {rows_in:,} rows read, {rows_out:,} kept")
+
+    if hash_dir is not None:
+        seen.save()
+    if writer is None:
+        return {}
+    indices = writer.close()
+    index_manager = CSVIndexManager(out_dir)
+    index_manager.indices.update(indices)
+    index_manager.save_indices()
+    return indices
+
+
+def main(in_csv, out_dir=OUTPUT_DIR, layout="quick", chunk_size=CHUNK_SIZE,
+         dedup_key='row', hash_dir=None):
+    start_time = time.time()
+    indices = stream_clean(in_csv, out_dir, layout, chunk_size, dedup_key, hash_dir)
+    print(f"Wrote {len(indices)} yearly files to {out_dir} in {time.time() - start_time:.2f} seconds")
+    for file_name, index in indices.items():
+        print(f"  {file_name}: {index['row_count']:,} rows")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('raw_csv', help="raw police.uk street-level CSV")
+    parser.add_argument('--out-dir', default=str(OUTPUT_DIR))
+    parser.add_argument('--layout', choices=LAYOUTS, default="quick")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--dedup-key', choices=list(DEDUP_KEYS), default='row')
+    parser.add_argument('--hash-dir', default=None, help="persist dedup hashes here across runs")
+    args = parser.parse_args()
+    main(args.raw_csv, args.out_dir, args.layout, args.chunk_size, args.dedup_key, args.hash_dir)
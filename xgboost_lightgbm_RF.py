@@ -15,9 +15,22 @@ from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 import matplotlib.pyplot as plt
 
-# ─── 1) Load & preprocess the CSV ────────────────────────────────────────────────
-csv_path = r"combined_features.csv"
-df = pd.read_csv(csv_path)
+from feature_store import read_features
+
+# ─── 1) Load & preprocess the features ──────────────────────────────────────────
+# Only the model's columns are read from the feature store (plus any column
+# with missing values, so the dropna() below drops the same rows as before)
+store_columns = [
+    'LSOA code','WD24CD','WD24NM','month','y_true',
+    'crime_count_lag1','crime_count_lag3','crime_count_lag12',
+    'num_crimes_past_year_1km','MedianPrice',
+    'month_sin','month_cos',
+    'rank_last_year','months_since_last_crime',
+    'IMD Rank London', 'IMD Decile London', 'Population', 'PopulationPerSqKm', 'AreaSqKm',
+    'crime_count_lag1_z','crime_count_lag3_z','crime_count_lag12_z',
+    'num_crimes_past_year_1km_z','MedianPrice_z','months_since_last_crime_z'
+]
+df = read_features(store_columns, with_nullable=True)
 
 # 1.1) Rename "LSOA code" → "LSOA_code", encode if needed
 df.rename(columns={"LSOA code": "LSOA_code"}, inplace=True)